@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# Memory use and load time of the branch graph of a synthetic repository
+# with many managed branches, loaded in-process through regit.Repository.
+#
+#   python3 benchmarks/branches.py [--branches N] [--runs N]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, topdir)
+
+from regit.regit import Branch, Repository
+
+
+def git(repo, *args, input=None):
+    return subprocess.check_output(
+        ["git", "-C", repo] + list(args), input=input, universal_newlines=True
+    ).rstrip()
+
+
+def make_repo(path, branches):
+    # branches based on master, each depending on up to two earlier ones,
+    # records in a single .git/regit/branches.json
+    git(path, "init", "-q", "-b", "master")
+    git(path, "config", "user.email", "bench@regit")
+    git(path, "config", "user.name", "bench")
+    git(path, "commit", "-q", "--allow-empty", "-m", "init")
+    master = git(path, "rev-parse", "HEAD")
+
+    updates = []
+    records = {}
+    for n in range(branches):
+        name = "bench/%s" % n
+        updates.append("create refs/heads/%s %s\n" % (name, master))
+        deps = ["bench/%s" % x for x in (n // 2, n - 1) if 0 <= x < n]
+        records[name] = {
+            "base": "master",
+            "deps": sorted(set(deps)),
+            "rebase_tip": master,
+        }
+
+    git(path, "update-ref", "--stdin", input="".join(updates))
+    os.makedirs(os.path.join(path, ".git", "regit"))
+    with open(os.path.join(path, ".git", "regit", "branches.json"), "w") as f:
+        json.dump({"version": 1, "branches": records}, f)
+
+
+def load(path):
+    repo = Repository.find(path)
+    repo.load_branches(True)
+    repo.get_graph().topo_order()
+    return repo
+
+
+class DictBranch(object):
+    # same fields as Branch, with a per-instance __dict__
+    pass
+
+
+def record(cls, name):
+    res = cls.__new__(cls)
+    for field in Branch.__slots__:
+        setattr(res, field, None)
+    res.name = name
+    return res
+
+
+def instance_size(cls, count):
+    tracemalloc.start()
+    objects = [record(cls, "bench/%s" % n) for n in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return size / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--branches", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="regit-bench-") as path:
+        make_repo(path, args.branches)
+
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            repo = load(path)
+            times.append(time.perf_counter() - start)
+            repo.close()
+        times.sort()
+
+        tracemalloc.start()
+        repo = load(path)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        repo.close()
+
+    print(
+        "load %s branches: min %6.1fms  median %6.1fms  (%s runs)"
+        % (args.branches, times[0] * 1000, times[len(times) // 2] * 1000, args.runs)
+    )
+    print(
+        "memory: %.1f MiB retained, %.1f MiB peak, %.0f bytes per branch"
+        % (current / 2**20, peak / 2**20, current / args.branches)
+    )
+    print(
+        "one record: Branch %.0f bytes, with __dict__ %.0f bytes"
+        % (instance_size(Branch, 1000), instance_size(DictBranch, 1000))
+    )
+
+
+if __name__ == "__main__":
+    main()
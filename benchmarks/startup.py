@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+#
+# Tracks the wall-clock cost of "git dep show" and "git dep status" on a
+# synthetic repository with a configurable number of managed branches.
+#
+#   python3 benchmarks/startup.py [--branches N] [--runs N]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git(repo, *args, input=None):
+    return subprocess.check_output(
+        ["git", "-C", repo] + list(args), input=input, universal_newlines=True
+    ).rstrip()
+
+
+def make_repo(path, branches):
+    # a chain of branches, each one based on master and depending on the
+    # previous one, created with plumbing only
+    git(path, "init", "-q", "-b", "master")
+    git(path, "config", "user.email", "bench@regit")
+    git(path, "config", "user.name", "bench")
+    git(path, "commit", "-q", "--allow-empty", "-m", "init")
+    master = git(path, "rev-parse", "HEAD")
+    tree = git(path, "rev-parse", "HEAD^{tree}")
+
+    branch_dir = os.path.join(path, ".git", "regit", "branches")
+    os.makedirs(branch_dir)
+
+    updates = []
+    prev = None
+    for n in range(branches):
+        name = "bench/%s" % n
+        commit = git(path, "commit-tree", tree, "-p", master, "-m", name)
+        updates.append("create refs/heads/%s %s\n" % (name, commit))
+        bdict = {"base": "master", "deps": [prev] if prev else [], "rebase_tip": master}
+        with open(os.path.join(branch_dir, name.replace("/", "__")), "w") as f:
+            json.dump(bdict, f)
+        prev = name
+
+    git(path, "update-ref", "--stdin", input="".join(updates))
+    git(path, "checkout", "-q", prev)
+
+
+def measure(repo, args, runs):
+    env = dict(os.environ, PYTHONPATH=topdir)
+    res = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.check_call(
+            [sys.executable, "-m", "regit"] + args,
+            cwd=repo,
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        res.append(time.perf_counter() - start)
+    return sorted(res)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--branches", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="regit-bench-") as repo:
+        make_repo(repo, args.branches)
+        for cmd in (["show"], ["status"], ["status", "--all"]):
+            res = measure(repo, cmd, args.runs)
+            print(
+                "git dep %-14s min %6.1fms  median %6.1fms  (%s branches, %s runs)"
+                % (
+                    " ".join(cmd),
+                    res[0] * 1000,
+                    res[len(res) // 2] * 1000,
+                    args.branches,
+                    args.runs,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
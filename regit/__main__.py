@@ -0,0 +1,3 @@
+from regit.regit import main
+
+main()
@@ -0,0 +1,104 @@
+import json
+import os
+
+# Persistent cache of staleness answers, stored in .git/regit/status-cache.
+#
+# "missing" maps "<tip a> <tip b>" to the answer of "a is missing commits from
+# b", which never changes for a given pair of commits. "stale" maps a branch
+# name to its needs_update() result together with the tip, base and deps of
+# every branch it was computed from, it is only served while all of those are
+# unchanged.
+
+VERSION = 2
+
+
+class StatusCache(object):
+    def __init__(self, path):
+        self.path = path
+        self.missing = {}
+        self.stale = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+
+        if data.get("version") != VERSION:
+            return
+
+        self.missing = data.get("missing", {})
+        self.stale = data.get("stale", {})
+        self.hits = data.get("hits", 0)
+        self.misses = data.get("misses", 0)
+
+    def save(self, tips=None):
+        if not self.dirty:
+            return
+
+        if tips is not None:
+            # answers about commits that are not branch tips anymore will not
+            # be asked for again
+            tips = set(tips)
+            self.missing = {
+                key: value
+                for key, value in self.missing.items()
+                if tips.issuperset(key.split())
+            }
+
+        data = {
+            "version": VERSION,
+            "missing": self.missing,
+            "stale": self.stale,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # concurrent invocations each write their own file, the last one wins
+        tmp = "%s.tmp.%s" % (self.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def clear(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.__init__(self.path)
+
+    def count(self, hit):
+        # the counters are saved along with new answers, they alone are not
+        # worth rewriting the file for
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get_missing(self, a, b):
+        res = self.missing.get("%s %s" % (a, b))
+        self.count(res is not None)
+        return res
+
+    def set_missing(self, a, b, value):
+        self.missing["%s %s" % (a, b)] = value
+        self.dirty = True
+
+    def get_stale(self, name, key):
+        entry = self.stale.get(name)
+        if entry and entry["key"] == key:
+            self.count(True)
+            return entry["needs_update"]
+
+        self.count(False)
+        return None
+
+    def set_stale(self, name, key, value):
+        self.stale[name] = {"key": key, "needs_update": value}
+        self.dirty = True
@@ -0,0 +1,312 @@
+import contextlib
+import ctypes
+import ctypes.util
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import traceback
+
+# "git dep daemon": keeps a Repository (ref snapshot, dependency graph,
+# status answers) in memory and answers the read-only commands over a Unix
+# socket in .git/regit/daemon.sock. The command line sends its arguments
+# there first and only does the work itself if nobody answers.
+#
+# Before every answer the daemon checks whether refs, packed-refs, HEAD or
+# the branch records changed since the last one (with inotify, or by
+# comparing mtimes where that is not available) and reloads if so.
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+watch_mask = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+event_header = struct.Struct("iIII")
+
+
+def relevant(dirpath, name, repo):
+    # changes of these files don't affect any answer (or are our own)
+    if name.endswith(".lock") or ".tmp" in name:
+        return False
+    if dirpath in (repo.gitdir, repo.commondir):
+        return name in ("HEAD", "packed-refs", "refs", "regit")
+    if dirpath in (
+        os.path.join(repo.commondir, "regit"),
+        os.path.join(repo.gitdir, "regit"),
+    ):
+        if name.startswith("graph."):
+            return False
+        return name not in ("status-cache", "daemon.sock", "state", "worktrees")
+    return True
+
+
+def watched_trees(repo):
+    # (path, recursive)
+    return [
+        (repo.commondir, False),
+        (repo.gitdir, False),
+        (os.path.join(repo.commondir, "refs"), True),
+        (os.path.join(repo.commondir, "regit"), False),
+        (os.path.join(repo.commondir, "regit", "branches"), False),
+    ]
+
+
+class InotifyWatcher(object):
+    def __init__(self, repo):
+        self.repo = repo
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.recursive = set()
+        for path, recursive in watched_trees(repo):
+            self.add(path, recursive)
+
+    def add(self, path, recursive):
+        if not os.path.isdir(path):
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), watch_mask)
+        if wd < 0:
+            return
+        self.watches[wd] = path
+        if recursive:
+            self.recursive.add(path)
+            for entry in os.scandir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    self.add(entry.path, True)
+
+    def changed(self):
+        # drains the pending events, true if any of them matters
+        res = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return res
+
+            pos = 0
+            while pos < len(data):
+                wd, mask, cookie, length = event_header.unpack_from(data, pos)
+                pos += event_header.size
+                name = os.fsdecode(data[pos : pos + length].rstrip(b"\0"))
+                pos += length
+
+                dirpath = self.watches.get(wd)
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if dirpath is None or not relevant(dirpath, name, self.repo):
+                    continue
+
+                res = True
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # e.g., the first branch below a new "prefix/"
+                    self.add(os.path.join(dirpath, name), dirpath in self.recursive)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    # fallback: compares the mtimes of everything that would be watched
+    def __init__(self, repo):
+        self.repo = repo
+        self.state = self.snapshot()
+
+    def snapshot(self):
+        res = {}
+        for path, recursive in watched_trees(self.repo):
+            todo = [path]
+            while todo:
+                dirpath = todo.pop()
+                try:
+                    entries = list(os.scandir(dirpath))
+                except OSError:
+                    continue
+                for entry in entries:
+                    if not relevant(dirpath, entry.name, self.repo):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            todo.append(entry.path)
+                        continue
+                    res[entry.path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return res
+
+    def changed(self):
+        state = self.snapshot()
+        res = state != self.state
+        self.state = state
+        return res
+
+    def close(self):
+        pass
+
+
+def make_watcher(repo, poll=False):
+    if not poll:
+        try:
+            return InotifyWatcher(repo)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(repo)
+
+
+def run(repo, parser, argv):
+    # runs one command line in-process, returns the reply for the client.
+    # <parser> is regit.make_parser(), set up once for all requests.
+    from regit import regit
+
+    out = io.StringIO()
+    err = io.StringIO()
+    status = 0
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            args = parser.parse_args(argv)
+            if (
+                args.cmd not in regit.daemon_commands
+                or args.cont
+                or args.abort
+                or args.cmd == "status"
+                and args.show
+            ):
+                return {"fallback": True}
+            regit.repo = repo
+            args.func(args)
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                status = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            repo.forget()
+            status = 1
+
+    return {"status": status, "stdout": out.getvalue(), "stderr": err.getvalue()}
+
+
+def read_message(conn):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data.decode()) if data else None
+
+
+def send_message(conn, message):
+    conn.sendall(json.dumps(message).encode() + b"\n")
+
+
+def query(path, argv, timeout=10):
+    # the daemon's answer to <argv>, None if there is no daemon or it
+    # cannot answer this one
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(timeout)
+            conn.connect(path)
+            send_message(conn, {"argv": argv})
+            reply = read_message(conn)
+    except (OSError, ValueError):
+        return None
+
+    if not reply or reply.get("fallback"):
+        return None
+    return reply
+
+
+def serve(repo, poll=False, timeout=1):
+    # <timeout>: how long a client may take to send its request
+    from regit import regit
+
+    path = repo.daemon_socket()
+    if os.path.exists(path):
+        if query(path, ["daemon", "--ping"]) is not None:
+            raise RuntimeError("a daemon is already running (%s)" % path)
+        os.unlink(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    parser = regit.make_parser()
+    watcher = make_watcher(repo, poll)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # only for us: whoever can connect can run commands as us
+        umask = os.umask(0o177)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(umask)
+        sock.listen(16)
+        print(
+            "regit: daemon listening on %s (%s)."
+            % (path, "inotify" if isinstance(watcher, InotifyWatcher) else "polling"),
+            flush=True,
+        )
+
+        while True:
+            conn, _ = sock.accept()
+            with conn:
+                # stalled clients must not block everyone else
+                conn.settimeout(timeout)
+                try:
+                    request = read_message(conn)
+                except (OSError, ValueError):
+                    continue
+                if not request:
+                    continue
+
+                argv = request.get("argv") or []
+                if argv[:1] == ["daemon"]:
+                    stop = "--stop" in argv
+                    try:
+                        send_message(conn, {"status": 0, "stdout": "", "stderr": ""})
+                    except OSError:
+                        pass
+                    if stop:
+                        break
+                    continue
+
+                if watcher.changed():
+                    repo.forget()
+                reply = run(repo, parser, argv)
+                try:
+                    send_message(conn, reply)
+                except OSError:
+                    # the client is gone
+                    pass
+    finally:
+        sock.close()
+        watcher.close()
+        if os.path.exists(path):
+            os.unlink(path)
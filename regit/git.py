@@ -0,0 +1,282 @@
+import os
+import subprocess
+import sys
+import threading
+
+
+class CatFile(object):
+    # A long-lived "git cat-file --batch-check" (or "--batch") process. Ref
+    # resolution and object lookups are sent through it instead of forking
+    # git each time.
+    def __init__(self, mode="--batch-check", cwd=None):
+        self.mode = mode
+        self.cwd = cwd
+        self.proc = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.proc = subprocess.Popen(
+            ["git", "cat-file", self.mode],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.cwd,
+        )
+
+    def request(self, rev):
+        # returns (objectname, objecttype, content), content is only read in
+        # "--batch" mode
+        if not rev or "\n" in rev:
+            return None
+
+        with self.lock:
+            if not self.proc:
+                self.start()
+
+            self.proc.stdin.write(rev.encode() + b"\n")
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline().decode().rstrip("\n")
+
+            if not line or line.endswith(" missing") or line.endswith(" ambiguous"):
+                return None
+
+            objectname, objecttype, size = line.split(" ")
+            content = None
+            if self.mode == "--batch":
+                content = self.proc.stdout.read(int(size) + 1)[:-1]
+
+        return (objectname, objecttype, content)
+
+    def lookup(self, rev):
+        res = self.request(rev)
+        if not res:
+            return None
+        return res[:2]
+
+    def close(self):
+        with self.lock:
+            if self.proc:
+                self.proc.stdin.close()
+                self.proc.wait()
+                self.proc = None
+
+
+class Status(object):
+    # parsed "git status --porcelain=v2 -z --untracked-files=no"
+    def __init__(self, out):
+        # list of (kind, xy, path), kind being "1" (ordinary), "2" (renamed or
+        # copied) or "u" (unmerged)
+        self.entries = []
+
+        fields = {"1": 8, "2": 9, "u": 10}
+        records = iter(out.split("\0"))
+        for record in records:
+            kind = record[:1]
+            if kind not in fields:
+                continue
+            parts = record.split(" ", fields[kind])
+            self.entries.append((kind, parts[1], parts[-1]))
+            if kind == "2":
+                # original path
+                next(records, None)
+
+    def clean(self):
+        return not self.entries
+
+    def automerge_complete(self):
+        # everything (e.g., resolved by rerere) is staged, nothing is unmerged
+        for kind, xy, path in self.entries:
+            if kind == "u" or xy[0] not in "ADMR" or xy[1] != ".":
+                return False
+        return True
+
+
+def read_gitfile(path):
+    # ".git" files and "commondir" contain a (possibly relative) path
+    with open(path, "r") as f:
+        value = f.readline().rstrip("\n")
+    if value.startswith("gitdir: "):
+        value = value[len("gitdir: ") :]
+    return os.path.normpath(os.path.join(os.path.dirname(path), value))
+
+
+def common_dir(gitdir):
+    try:
+        return read_gitfile(os.path.join(gitdir, "commondir"))
+    except FileNotFoundError:
+        return gitdir
+
+
+def has_core_worktree(gitdir):
+    # true if the repository's config sets core.worktree
+    section = None
+    for name in ("config", "config.worktree"):
+        try:
+            with open(os.path.join(gitdir, name), "r") as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for line in lines:
+            line = line.strip()
+            if line.startswith("["):
+                section = line[1:].split("]")[0].strip().lower()
+            elif section == "core" and line.split("=")[0].strip().lower() == "worktree":
+                return True
+    return False
+
+
+def find_repository(path=None):
+    # (topdir, gitdir, commondir), found without running git. Returns None
+    # if the layout is unusual, callers should ask "git rev-parse" then.
+    if os.environ.get("GIT_DIR"):
+        if not os.environ.get("GIT_WORK_TREE"):
+            return None
+        gitdir = os.path.abspath(os.environ["GIT_DIR"])
+        topdir = os.path.abspath(os.environ["GIT_WORK_TREE"])
+        return (topdir, gitdir, common_dir(gitdir))
+
+    if os.environ.get("GIT_CEILING_DIRECTORIES"):
+        return None
+
+    path = os.path.abspath(path or os.getcwd())
+    if ".git" in path.split(os.sep):
+        # inside a git directory, there is no worktree
+        return None
+
+    while True:
+        dotgit = os.path.join(path, ".git")
+        gitdir = None
+        if os.path.isdir(dotgit):
+            gitdir = dotgit
+        elif os.path.isfile(dotgit):
+            gitdir = read_gitfile(dotgit)
+        if gitdir:
+            commondir = common_dir(gitdir)
+            if has_core_worktree(commondir) or has_core_worktree(gitdir):
+                return None
+            return (path, gitdir, commondir)
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+class Git(object):
+    # runs git in one repository (<path>, default: the current directory),
+    # with long-lived cat-file processes and the caches that go with them
+    def __init__(self, path=None):
+        self.path = path
+        self.catfile = CatFile("--batch-check", path)
+        self.catfile_batch = CatFile("--batch", path)
+        self.merge_bases = {}
+        self._status = None
+        # cleared once git turns out not to know "merge-tree --merge-base"
+        self.merge_base_option = True
+
+    def close(self):
+        self.catfile.close()
+        self.catfile_batch.close()
+
+    def reset(self):
+        # refs or the worktree may have changed, don't serve stale answers
+        self._status = None
+        self.catfile.close()
+        self.catfile_batch.close()
+
+    def output(self, cmd, input=None, env=None):
+        git = ["git"]
+        git.extend(cmd)
+        return subprocess.check_output(
+            git,
+            universal_newlines=True,
+            stderr=subprocess.DEVNULL,
+            input=input,
+            env=env,
+            cwd=self.path,
+        )
+
+    def command(self, cmd, quiet=False):
+        self.reset()
+
+        git = ["git"]
+        git.extend(cmd)
+        if quiet:
+            out = subprocess.DEVNULL
+            err = subprocess.DEVNULL
+        else:
+            out = sys.stdout
+            err = sys.stderr
+
+        return subprocess.check_call(git, stdout=out, stderr=err, cwd=self.path)
+
+    def check(self, cmd):
+        self.reset()
+
+        try:
+            subprocess.check_output(cmd, shell=True, cwd=self.path)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def status(self):
+        # shared by all checks until the next write
+        if self._status is None:
+            self._status = Status(
+                self.output(["status", "--porcelain=v2", "-z", "--untracked-files=no"])
+            )
+        return self._status
+
+    def rev_parse(self, ref):
+        res = self.catfile.lookup(ref)
+        if not res:
+            return None
+        return res[0]
+
+    def read_object(self, rev):
+        # returns (objectname, objecttype, content) or None
+        return self.catfile_batch.request(rev)
+
+    def read_objects(self, revs):
+        # like read_object() for many objects at once, in a single round trip.
+        # returns {rev: content}, missing objects are left out.
+        if not revs:
+            return {}
+
+        proc = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.path,
+        )
+        out, _ = proc.communicate("".join("%s\n" % rev for rev in revs).encode())
+
+        res = {}
+        pos = 0
+        for rev in revs:
+            end = out.index(b"\n", pos)
+            header = out[pos:end].decode().split(" ")
+            pos = end + 1
+            if len(header) != 3:
+                continue
+            size = int(header[2])
+            res[rev] = out[pos : pos + size]
+            pos += size + 1
+        return res
+
+    def commit_id(self, ref):
+        res = self.catfile.lookup("%s^{commit}" % ref)
+        if not res:
+            return None
+        return res[0]
+
+    def merge_base(self, a, b):
+        # merge bases of two commits never change, so cache them by commit id
+        key = (self.commit_id(a) or a, self.commit_id(b) or b)
+        res = self.merge_bases.get(key)
+        if res is None:
+            res = self.output(["merge-base", key[0], key[1]]).rstrip()
+            self.merge_bases[key] = res
+        return res
+
@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import regit
+
+# Updates several branches at once. The in-memory update (replay.py) of
+# every branch runs in a worker thread first, that needs no checkout. Only
+# branches that conflict there get "git dep update" run in their own linked
+# worktree under .git/regit/worktrees/. A worktree is removed after a
+# successful update and kept (including its regit state) if the update
+# stopped for conflict resolution.
+
+
+def worktree_path(worktree_dir, name):
+    return os.path.join(worktree_dir, name.replace("/", "__"))
+
+
+def child_env():
+    env = dict(os.environ)
+    for var in ("GIT_DIR", "GIT_WORK_TREE", "GIT_INDEX_FILE"):
+        env.pop(var, None)
+
+    pythonpath = os.path.dirname(os.path.dirname(os.path.abspath(regit.__file__)))
+    if env.get("PYTHONPATH"):
+        pythonpath = pythonpath + os.pathsep + env["PYTHONPATH"]
+    env["PYTHONPATH"] = pythonpath
+    return env
+
+
+def update_in_worktree(git, name, path):
+    if os.path.exists(path):
+        return (
+            False,
+            "regit: worktree %s already exists (unfinished update?)\n" % path,
+        )
+
+    try:
+        git.output(["worktree", "add", path, name])
+    except subprocess.CalledProcessError:
+        return (
+            False,
+            'regit: cannot check out "%s" in a new worktree '
+            "(checked out elsewhere?)\n" % name,
+        )
+
+    proc = subprocess.run(
+        [sys.executable, "-m", "regit", "update"],
+        cwd=path,
+        env=child_env(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+
+    if proc.returncode != 0:
+        return (False, proc.stdout)
+
+    git.output(["worktree", "remove", "--force", path])
+    return (True, proc.stdout)
+
+
+def build_in_memory(git, work, jobs):
+    # runs replay.update_branch() for every job of <work> in a thread pool.
+    # Returns the results in the order of <work>, None where a merge
+    # conflicted.
+    from regit import replay
+
+    def build(job):
+        try:
+            return replay.update_branch(git, *job)
+        except replay.Conflict:
+            return None
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(build, work))
+
+
+def update_branches(git, names, worktree_dir, jobs):
+    # returns [(name, success, output)], in the order of <names>
+    os.makedirs(worktree_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                update_in_worktree, git, name, worktree_path(worktree_dir, name)
+            )
+            for name in names
+        ]
+        res = []
+        for name, future in zip(names, futures):
+            success, output = future.result()
+            res.append((name, success, output))
+
+    return res
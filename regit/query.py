@@ -0,0 +1,39 @@
+import asyncio
+import os
+import subprocess
+
+# Runs many independent, read-only git commands at once: each one is an
+# asyncio subprocess, at most <jobs> of them alive at a time. Results come
+# back in the order the commands were given, whatever order they finish in,
+# so callers print exactly what they would have printed running them one by
+# one.
+
+
+async def run_git(path, cmd, limit):
+    async with limit:
+        proc = await asyncio.create_subprocess_exec(
+            "git",
+            *cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=path,
+        )
+        out, _ = await proc.communicate()
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, ["git"] + cmd, out)
+    return out.decode()
+
+
+async def run_all(path, cmds, jobs):
+    limit = asyncio.Semaphore(jobs)
+    return await asyncio.gather(*(run_git(path, cmd, limit) for cmd in cmds))
+
+
+def outputs(git, cmds, jobs=None):
+    # like [git.output(cmd) for cmd in cmds], with up to <jobs> (default: one
+    # per CPU) commands running concurrently
+    if not cmds:
+        return []
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    return asyncio.run(run_all(git.path, cmds, jobs))
@@ -1,55 +1,318 @@
 #!/usr/bin/env python
 
 import argparse
+import atexit
 import json
 import os
 import re
 import subprocess
 import sys
-import tempfile
 
-topdir = None
-
-re_branch = re.compile(r"  (?P<name>.*)")
-re_current = re.compile(r"\* (?P<name>.*)")
-re_commit_oneline = re.compile(r"(?P<hash>[a-f0-9]{40,40}) (?P<descr>.*)")
+from regit import git
+from regit import store
 
+# the repository the command line works on
+repo = None
 
-class Branch(object):
-    map = {}
-    list = []
-    current = None
+ref_format = "%(refname)%00%(objectname)%00%(upstream)%00%(HEAD)%00%(worktreepath)"
+re_commit_oneline = re.compile(r"(?P<hash>[a-f0-9]{40,40}) (?P<descr>.*)")
 
-    def __init__(self, name):
-        self.name = name
-        self.base = None
-        self.deps = None
-        self.rebase_tip = None
-        self.updated = False
-        self.have_data = False
-        self.pr = None
-        Branch.map[name] = self
+# read-only commands a running "git dep daemon" answers
+daemon_commands = ("status", "show", "dependents")
+
+
+def missing_commits_cmd(a, b):
+    # prints a commit if a is missing commits from b
+    return [
+        "rev-list",
+        "--max-count=1",
+        "--invert-grep",
+        "--grep=^DEPENDENCY UPDATE",
+        "%s..%s" % (a, b),
+    ]
+
+
+class Repository(object):
+    # Everything regit knows about one repository: its paths, the git
+    # backend, the branches and their dependency graph. Several of these can
+    # be used side by side in one process.
+    def __init__(self, topdir, gitdir, commondir):
+        self.topdir = topdir
+        self.gitdir = gitdir
+        self.commondir = commondir
+        self.git = git.Git(topdir)
+        self.map = {}
+        self.list = []
+        self.current = None
+        self.graph = None
+        self.fresh = False
+        self.store = None
+        self.meta = None
+        self.loaded = False
+
+    def find(path=None):
+        # the repository containing <path> (default: the current directory)
+        res = git.find_repository(path)
+        if not res:
+            try:
+                out = git.Git(path).output(
+                    ["rev-parse", "--show-toplevel", "--git-dir", "--git-common-dir"]
+                )
+            except subprocess.CalledProcessError:
+                return None
+            res = [os.path.abspath(os.path.join(path or "", x)) for x in out.splitlines()]
+            if len(res) != 3:
+                return None
+
+        return Repository(*res)
+
+    def close(self):
+        self.git.close()
+
+    def load_refs(self):
+        # one snapshot of all local branches: tip, upstream and where (if at
+        # all) they are checked out. Valid until command() writes.
+        # Returns the branch checked out here, None if HEAD is detached.
+        out = self.output(
+            ["for-each-ref", "--format=%s" % ref_format, "refs/heads/", store.REF]
+        )
+        for branch in self.map.values():
+            branch.tip = None
 
-    def switch(branch, base=None):
-        if branch == Branch.current:
+        current = None
+        self.meta = ""
+        for line in out.splitlines():
+            refname, objectname, upstream, head, worktree = line.split("\0")
+            if refname == store.REF:
+                self.meta = objectname
+                continue
+            branch = self.maybe_new(refname[len("refs/heads/") :])
+            branch.tip = objectname
+            branch.upstream = upstream or None
+            branch.worktree = worktree or None
+            if head == "*":
+                current = branch
+
+        self.fresh = True
+        return current
+
+    def load_branches(self, have_state=False):
+        if not self.loaded:
+            self.map = {}
+            self.current = self.load_refs()
+            self.list = [value for (key, value) in sorted(self.map.items())]
+            self.graph = None
+            self.loaded = True
+
+        if not have_state:
+            if self.current is None:
+                _err("regit: HEAD is detached, please check out a branch.")
+            if self.current.name.startswith("regit/"):
+                _err("regit: cannot work on regit/* branches. Exiting.")
+
+    def forget(self):
+        # something outside of this process changed the repository, start
+        # over on the next load_branches()
+        self.git.reset()
+        self.loaded = False
+        self.fresh = False
+        self.graph = None
+        self.store = None
+        self.meta = None
+
+    def invalidate(self):
+        self.fresh = False
+        if self.graph:
+            self.graph.invalidate()
+
+    def get_graph(self):
+        if not self.graph:
+            self.graph = DependencyGraph(self)
+            self.graph.load()
+        return self.graph
+
+    def switch(self, branch, base=None):
+        if branch == self.current:
             return
 
         if base:
-            git_command(["checkout", "-B", branch.name, base.name], True)
+            self.command(["checkout", "-B", branch.name, base.name], True)
         else:
-            git_command(["checkout", branch.name, "--"], True)
+            self.command(["checkout", branch.name, "--"], True)
 
-        Branch.current = branch
+        self.current = branch
 
-    def datafile():
-        return os.path.join(topdir, ".regit")
+    def datafile(self):
+        return os.path.join(self.topdir, ".regit")
 
-    def maybe_new(name):
-        existing = Branch.map.get(name)
+    def maybe_new(self, name):
+        existing = self.map.get(name)
         if existing:
             return existing
 
-        return Branch(name)
+        return Branch(self, name)
+
+    def name_to_branch(self, list):
+        list = listify(list)
+        res = []
+        for x in list:
+            _tmp = self.map.get(x)
+            if _tmp:
+                res.append(_tmp)
+        return res
+
+    def branch_dir(self):
+        return os.path.join(self.commondir, "regit", "branches")
+
+    def status_cache_file(self):
+        return os.path.join(self.commondir, "regit", "status-cache")
+
+    def worktree_dir(self):
+        return os.path.join(self.commondir, "regit", "worktrees")
+
+    def store_file(self):
+        return os.path.join(self.commondir, "regit", "branches.json")
+
+    def get_store(self):
+        if self.store is None:
+            try:
+                self.store = store.open_store(
+                    self.git, self.branch_dir(), self.store_file(), self.meta
+                )
+            except ValueError as e:
+                _err("regit: %s (written by a newer regit?)" % e)
+        return self.store
+
+    def get_rebase_head_name(self):
+        for backend in ("rebase-merge", "rebase-apply"):
+            f = os.path.join(self.gitdir, backend, "head-name")
+            if os.path.isfile(f):
+                return open(f, "r").readline().rstrip()
+
+        return None
+
+    def output(self, cmd):
+        return self.git.output(cmd)
+
+    def command(self, cmd, quiet=False):
+        self.invalidate()
+
+        return self.git.command(cmd, quiet)
+
+    def check(self, cmd):
+        return self.git.check(cmd)
+
+    def rev_parse(self, ref):
+        return self.git.rev_parse(ref)
+
+    def state_file(self):
+        # per worktree
+        return os.path.join(self.gitdir, "regit", "state")
+
+    def graph_file(self, format):
+        # where "status --show" puts the rendered graph
+        return os.path.join(self.gitdir, "regit", "graph." + format)
+
+    def daemon_socket(self):
+        # per worktree, as HEAD is
+        return os.path.join(self.gitdir, "regit", "daemon.sock")
+
+    def save_state(self, state):
+        os.makedirs(os.path.dirname(self.state_file()), exist_ok=True)
+        with open(self.state_file(), "w") as statefile:
+            json.dump(state, statefile)
+
+    def load_state(self):
+        try:
+            statefile = open(self.state_file(), "r")
+        except:
+            return None
+
+        try:
+            return json.load(statefile)
+        except ValueError:
+            return None
+
+    # return true if a is missing commits from b
+    def branch_missing_commits(self, a, b):
+        out = self.output(missing_commits_cmd(a, b))
+        return bool(out.strip())
+
+    def workdir_clean(self):
+        return self.git.status().clean()
+
+    def automerge_complete(self):
+        return self.git.status().automerge_complete()
+
+    def prune_merge_cache(self):
+        # A cached merge can only be reused while all of its inputs are branch
+        # tips. Drop the ones where that is no longer the case.
+        out = self.output(
+            ["for-each-ref", "--format=%(objectname) %(refname)", "refs/regit/cache/"]
+        )
+        if not out:
+            return
+
+        tips = set(branch.head() for branch in list(self.map.values()))
+
+        stale = []
+        for line in out.splitlines():
+            commit, refname = line.split(" ", 1)
+            inputs = []
+            while True:
+                obj = self.git.read_object(commit)
+                if not obj:
+                    break
+                headers, _, message = obj[2].decode(errors="replace").partition("\n\n")
+                parents = [
+                    x.split()[1] for x in headers.splitlines() if x.startswith("parent ")
+                ]
+                if len(parents) != 2 or not message.startswith("DEPENDENCY MERGE"):
+                    break
+                inputs.append(parents[1])
+                commit = parents[0]
+            inputs.append(commit)
+
+            if not tips.issuperset(inputs):
+                stale.append(refname)
+
+        if stale:
+            self.git.output(
+                ["update-ref", "--stdin"],
+                input="".join("delete %s\n" % refname for refname in stale),
+            )
+
+
+class Branch(object):
+    __slots__ = (
+        "repo",
+        "name",
+        "tip",
+        "upstream",
+        "worktree",
+        "base",
+        "deps",
+        "rebase_tip",
+        "tips",
+        "updated",
+        "have_data",
+        "pr",
+    )
+
+    def __init__(self, repo, name):
+        self.repo = repo
+        self.name = name
+        self.tip = None
+        self.upstream = None
+        self.worktree = None
+        self.base = None
+        self.deps = None
+        self.rebase_tip = None
+        self.tips = None
+        self.updated = False
+        self.have_data = False
+        self.pr = None
+        repo.map[name] = self
 
     def __str__(self):
         return self.name
@@ -61,17 +324,24 @@ class Branch(object):
             return self.name
 
     def head(self):
-        return git_command_output(["show-ref", "-s", "refs/heads/%s" % self]).rstrip()
+        if not self.repo.fresh:
+            self.repo.load_refs()
+        return self.tip
+
+    def checked_out_elsewhere(self):
+        return bool(self.worktree) and not os.path.samefile(
+            self.worktree, self.repo.topdir
+        )
 
     def merge_base(self, other):
-        return git_command_output(["merge-base", other.name, self.name]).rstrip()
+        return self.repo.git.merge_base(other.name, self.name)
 
     def based_on(self, other):
         return self.merge_base(other) == other.head()
 
     def dependency_commit(self):
         x = "DEPENDENCY UPDATE"
-        out = git_command_output(["log", "--pretty=oneline", "--grep=^%s$" % x])
+        out = self.repo.output(["log", "--pretty=oneline", "--grep=^%s$" % x])
         out = out.splitlines()
         if not out:
             return None
@@ -84,27 +354,8 @@ class Branch(object):
 
         return m.group("hash")
 
-    def get(have_state=False):
-        branches = {}
-        out = git_command_output(["branch"])
-        for line in out.splitlines():
-            line = line.rstrip()
-
-            m = re_branch.match(line)
-            if m:
-                Branch(m.group("name"))
-                continue
-
-            m = re_current.match(line)
-            if m:
-                if (not have_state) and m.group("name").startswith("regit/"):
-                    _err("regit: cannot work on regit/* branches. Exiting.")
-                Branch.current = Branch(m.group("name"))
-                continue
-        Branch.list = [value for (key, value) in sorted(Branch.map.items())]
-
     def has_branchfile(self):
-        return os.path.isfile(self.branch_file())
+        return self.repo.get_store().has(self.name)
 
     def get_data(self):
         if self.have_data:
@@ -113,14 +364,13 @@ class Branch(object):
         if not self.has_branchfile():
             return False
 
-        Branch.switch(self)
+        self.repo.get_graph()
 
-        f = open(self.branch_file(), "r")
-        bdict = json.load(f)
+    def set_data(self, bdict):
         base = bdict.get("base")
         if not base:
             _err("regit: branch dependency file has no base branch! exiting.")
-        self.base = Branch.map.get(base)
+        self.base = self.repo.map.get(base)
         if not self.base:
             _err(
                 'regit: branch "%s" has unknown base branch "%s". exiting.'
@@ -131,6 +381,7 @@ class Branch(object):
         if not rebase_tip:
             _err('regit: branch "%s" has unset rebase tip. exiting.' % (self.name))
         self.rebase_tip = rebase_tip
+        self.tips = bdict.get("tips")
 
         self.pr = bdict.get("pr")
         _deps = bdict.get("deps")
@@ -153,7 +404,7 @@ class Branch(object):
 
         self.deps = []
         for dep in deps:
-            b = Branch.map.get(dep)
+            b = self.repo.map.get(dep)
             if not b:
                 print(
                     'regit: error: branch "%s" depends on '
@@ -180,7 +431,7 @@ class Branch(object):
         tmp = None
         if deps:
             if _continue:
-                tmp = Branch.maybe_new("regit/base/%s" % self.name)
+                tmp = self.repo.maybe_new("regit/base/%s" % self.name)
             else:
                 tmp = "regit/base/%s" % self.name
         else:
@@ -195,49 +446,60 @@ class Branch(object):
                 print('regit: updating dependency "%s"...' % dep)
                 dep.update(recursive=recursive)
 
+        if not _continue and self.inputs_unchanged():
+            print('regit: branch "%s" is up to date.' % self)
+            self.updated = True
+            return
+
+        if self.checked_out_elsewhere():
+            # moving its ref would change that worktree behind its back
+            print(
+                'regit: skipping branch "%s", it is checked out in %s.'
+                % (self, self.worktree)
+            )
+            self.updated = True
+            return
+
         print('regit: updating branch "%s"...' % self)
 
         to_merge = []
         if not _continue:
-            if deps:
-                #                if not Branch.map.get(tmp):
-                tmp = Branch(tmp)
-                print(
-                    'regit: checking out base branch "%s" into '
-                    'intermediate branch "%s"...' % (self.base, tmp)
-                )
-                Branch.switch(tmp, self.base)
-            #                else:
-            #                    tmp = Branch.map.get(tmp)
-            #                    print("regit: updating temporary branch \"%s\"..." % (tmp))
-            #                    Branch.switch(tmp)
-            #                    deps = [s.base] + deps
+            to_merge = self.deps_to_merge(deps)
+            if self.update_in_memory(deps, to_merge):
+                self.updated = True
+                return
 
+            if deps:
+                tmp = Branch(self.repo, tmp)
+                cached = self.repo.git.rev_parse(self.merge_cache_ref(to_merge))
+                if to_merge and cached:
+                    print(
+                        'regit: checking out cached merge into intermediate branch "%s"...'
+                        % tmp
+                    )
+                    self.repo.command(["checkout", "-B", tmp.name, cached], True)
+                    self.repo.current = tmp
+                    to_merge = []
+                else:
+                    print(
+                        'regit: checking out base branch "%s" into '
+                        'intermediate branch "%s"...' % (self.base, tmp)
+                    )
+                    self.repo.switch(tmp, self.base)
             else:
                 tmp = self.base
-
-            for dep in deps:
-                if self.base == tmp or self.base == dep or not self.base.missing_from(dep):
-                    if not self.base == dep:
-                        print(
-                            'regit: skipping dependency "%s" as it is already part of base "%s"'
-                            % (dep, self.base)
-                        )
-                    continue
-
-                to_merge.append(dep)
         else:
             _tmp = _continue.get("already_done") or []
             for dep_name in _tmp:
-                already_done.append(Branch(dep_name))
+                already_done.append(Branch(self.repo, dep_name))
 
             for dep in deps:
                 if not dep in already_done:
                     to_merge.append(dep)
 
             if deps:
-                if str(tmp) in Branch.map:
-                    Branch.switch(tmp)
+                if str(tmp) in self.repo.map:
+                    self.repo.switch(tmp)
 
         if to_merge:
             print(
@@ -250,7 +512,7 @@ class Branch(object):
 
                 try:
                     print("regit: merging branch %s..." % dep.name_and_pr())
-                    git_command(
+                    self.repo.command(
                         [
                             "merge",
                             "--no-ff",
@@ -261,11 +523,11 @@ class Branch(object):
                     )
                     already_done.append(dep)
                 except subprocess.CalledProcessError as e:
-                    if is_automerge_complete():
+                    if self.repo.automerge_complete():
                         print(
                             "regit: rerere merging seems to have succeeded. Continuing."
                         )
-                        git_command(["commit", "--no-edit"])
+                        self.repo.command(["commit", "--no-edit"])
                         already_done.append(dep)
                     else:
                         state = {
@@ -276,10 +538,10 @@ class Branch(object):
                             "deps": str_list(deps),
                             "conflict": str(dep),
                             "already_done": str_list(already_done),
+                            "to_merge": str_list(to_merge),
                         }
 
-                        statefile = open(state_file(), "w")
-                        json.dump(state, statefile)
+                        self.repo.save_state(state)
 
                         _err(
                             'regit: merging failed (probably due to conflixts).' \
@@ -287,55 +549,186 @@ class Branch(object):
                             'regit: then run "git dep --continue".'
                         )
 
+        if deps:
+            if _continue:
+                merged = self.repo.name_to_branch(_continue.get("to_merge"))
+            else:
+                merged = to_merge
+            self.cache_merge(merged, tmp.head())
+
         if deps or (tmp == self.base) or _continue:
-            rebase_tmp = Branch.maybe_new("regit/tmp/%s" % self.name)
+            rebase_tmp = self.repo.maybe_new("regit/tmp/%s" % self.name)
 
             print('regit: rebasing "%s" onto "%s"...' % (self, rebase_tmp))
-            Branch.switch(self)
-            Branch.switch(rebase_tmp, self)
+            self.repo.switch(self)
+            self.repo.switch(rebase_tmp, self)
             try:
                 new_rebase_tip = tmp.head()
-                git_command(["rebase", "--onto", str(tmp), self.rebase_tip])
-                Branch.switch(self, rebase_tmp)
+                self.repo.command(["rebase", "--onto", str(tmp), self.rebase_tip])
+                self.repo.switch(self, rebase_tmp)
                 rebase_tmp.delete()
                 self.rebase_tip = new_rebase_tip
+                self.record_tips()
                 self.update_branch_file()
             except subprocess.CalledProcessError as e:
                 while True:
-                    if is_automerge_complete():
+                    if self.repo.automerge_complete():
                         print("regit: rerere auto-resolving of conflicts succeeded.")
                         try:
-                            git_command(["rebase", "--continue"])
-                            Branch.switch(self, rebase_tmp)
+                            self.repo.command(["rebase", "--continue"])
+                            self.repo.switch(self, rebase_tmp)
                             break
                         except subprocess.CalledProcessError:
                             pass
                     else:
                         self.save_rebase_state(deps, new_rebase_tip)
 
-        elif Branch.current != self:
-            Branch.switch(self)
+        elif self.repo.current != self:
+            self.repo.switch(self)
 
         self.updated = True
-        # if tmp != base:
-        #    git_command(['branch', '-D', tmp])
+
+    def deps_to_merge(self, deps):
+        to_merge = []
+        for dep in deps:
+            if self.base == dep or not self.base.missing_from(dep):
+                if not self.base == dep:
+                    print(
+                        'regit: skipping dependency "%s" as it is already part of base "%s"'
+                        % (dep, self.base)
+                    )
+                continue
+
+            to_merge.append(dep)
+
+        return to_merge
+
+    def update_in_memory(self, deps, to_merge):
+        # build the dependency merges and replay the branch's commits without
+        # touching the worktree. Returns False if the regular (checkout based)
+        # path is needed, e.g., for resolving conflicts.
+        from regit import replay
+
+        if not self.base:
+            return False
+
+        job, messages = self.in_memory_job(to_merge)
+        for line in messages:
+            print(line)
+
+        try:
+            res = replay.update_branch(self.repo.git, *job)
+        except replay.Conflict:
+            res = None
+
+        return self.finish_in_memory(deps, to_merge, job, res)
+
+    def in_memory_job(self, to_merge):
+        # the arguments of replay.update_branch() for this branch, looked up
+        # here so that the work itself can run in a worker thread. Returns
+        # (job, messages).
+        messages = []
+        merges = []
+        base = self.repo.git.rev_parse(self.merge_cache_ref(to_merge))
+        if base:
+            messages.append(
+                "regit: reusing cached merge of %s into %s."
+                % (", ".join(str_list(to_merge)), self.base)
+            )
+        else:
+            base = self.base.head()
+            for dep in to_merge:
+                if not dep.based_on(self.base):
+                    messages.append(
+                        "regit: warning: %s is not based on %s!" % (dep, self.base)
+                    )
+                messages.append("regit: merging branch %s..." % dep.name_and_pr())
+                merges.append((dep.head(), "DEPENDENCY MERGE: %s" % dep.name_and_pr()))
+
+        onto = self.base
+        if to_merge:
+            onto = "regit/base/%s" % self.name
+        messages.append('regit: rebasing "%s" onto "%s"...' % (self, onto))
+
+        return (base, merges, self.rebase_tip, self.head()), messages
+
+    def finish_in_memory(self, deps, to_merge, job, res):
+        # moves the refs to what replay.update_branch() returned for <job>.
+        # Returns False if it conflicted.
+        old_tip = job[3]
+        tmp, new_tip = res or (None, None)
+        if tmp and job[1]:
+            self.cache_merge(to_merge, tmp)
+        if not new_tip:
+            print(
+                'regit: "%s" cannot be updated in-memory, using the worktree...' % self
+            )
+            return False
+
+        if deps:
+            self.repo.command(["update-ref", "refs/heads/regit/base/%s" % self.name, tmp])
+
+        if self.repo.current == self:
+            self.repo.command(["reset", "--keep", new_tip], True)
+        else:
+            self.repo.command(["update-ref", "refs/heads/%s" % self.name, new_tip, old_tip])
+
+        self.rebase_tip = tmp
+        self.record_tips()
+        self.update_branch_file()
+        return True
+
+    def merge_cache_ref(self, to_merge):
+        # intermediate merge commits are cached by (base tip, ordered dep tips)
+        import hashlib
+
+        graph = self.repo.get_graph()
+        key = [graph.tip(self.base)]
+        for dep in to_merge:
+            key.append("%s %s" % (graph.tip(dep), dep.name_and_pr()))
+        key = hashlib.sha1("\n".join(key).encode()).hexdigest()
+
+        return "refs/regit/cache/%s" % key
+
+    def cache_merge(self, to_merge, commit):
+        if to_merge:
+            self.repo.command(["update-ref", self.merge_cache_ref(to_merge), commit])
 
     def finish_rebase(self, state):
-        rebase_tmp = Branch.maybe_new("regit/tmp/%s" % self)
-        Branch.switch(rebase_tmp)
-        Branch.switch(self, rebase_tmp)
+        rebase_tmp = self.repo.maybe_new("regit/tmp/%s" % self)
+        self.repo.switch(rebase_tmp)
+        self.repo.switch(self, rebase_tmp)
         rebase_tmp.delete()
         self.rebase_tip = state.get("new_rebase_tip")
+        self.record_tips()
         self.update_branch_file()
 
+    def current_tips(self):
+        graph = self.repo.get_graph()
+        tips = {"branch": graph.tip(self), "deps": {}}
+        if self.base:
+            tips["base"] = graph.tip(self.base)
+        for dep in self.deps or []:
+            tips["deps"][dep.name] = graph.tip(dep)
+        return tips
+
+    def record_tips(self):
+        # remember what the branch was last updated against
+        self.tips = self.current_tips()
+
+    def inputs_unchanged(self):
+        # true if neither the branch, nor its base or dependencies moved since
+        # the last update
+        return bool(self.tips) and self.tips == self.current_tips()
+
     def abort_rebase(self, state):
         print("regit: aborting.")
-        branch = Branch.maybe_new(state.get("branch"))
+        branch = self.repo.maybe_new(state.get("branch"))
 
-        if get_rebase_head_name() == "refs/heads/regit/tmp/%s" % branch:
-            git_command(["rebase", "--abort"])
+        if self.repo.get_rebase_head_name() == "refs/heads/regit/tmp/%s" % branch:
+            self.repo.command(["rebase", "--abort"])
 
-        Branch.switch(branch)
+        self.repo.switch(branch)
 
     def save_rebase_state(self, deps, new_rebase_tip):
         state = {
@@ -346,8 +739,7 @@ class Branch(object):
             "deps": str_list(deps),
             "new_rebase_tip": new_rebase_tip,
         }
-        statefile = open(state_file(), "w")
-        json.dump(state, statefile)
+        self.repo.save_state(state)
         _err(
             "regit: rebasing failed. manually complete rebase, then\n"
             'regit: run "git dep --continue" if the rebase succeeded,\n'
@@ -357,12 +749,22 @@ class Branch(object):
     def needs_update(self, quiet=True):
         self.get_data()
 
+        graph = self.repo.get_graph()
+        if quiet:
+            res = graph.known_stale(self)
+            if res is not None:
+                return res
+
+        key = graph.closure_key(self)
+
         deps = self.deps
         if self.base:
             deps = [self.base] + deps
 
         deps = deps or []
 
+        unchanged = self.inputs_unchanged()
+
         res = False
         for dep in deps:
             if dep.needs_update(quiet):
@@ -372,63 +774,77 @@ class Branch(object):
                     )
                     res = True
                 else:
-                    return True
+                    res = True
+                    break
 
-            if self.missing_from(dep):
+            if not unchanged and self.missing_from(dep):
                 if not quiet:
                     print('regit: branch "%s" needs to update "%s".' % (self, dep))
                     res = True
                 else:
-                    return True
+                    res = True
+                    break
 
+        graph.stale[self.name] = res
+        graph.get_cache().set_stale(self.name, key, res)
         return res
 
     def missing_from(self, other):
-        return branch_missing_commits(self.name, other.name)
+        if (other == self.base or other in (self.deps or [])) and self.inputs_unchanged():
+            return False
+        return self.repo.get_graph().missing_from(self, other)
 
     def get_deps(self, recursive=False, own=True):
+        self.get_data()
         if not recursive:
             if own:
                 return self.deps
             else:
                 return []
+
+        index = self.repo.get_graph().get_index()
+        if own:
+            bits = index.dep_ancestors.get(self, 0)
         else:
-            deps = set()
-            if own:
-                deps.update(self.deps or [])
+            bits = 0
             for dep in self.deps or []:
-                deps.update(dep.get_deps(True))
+                bits |= index.dep_ancestors.get(dep, 0)
 
-        return sorted(list(deps), key=lambda x: x.name)
+        return sorted(index.branches(bits), key=lambda x: x.name)
 
     def deps_depend_on(self, dep):
+        index = self.repo.get_graph().get_index()
         for _dep in self.deps or []:
-            if _dep.depends_on(dep):
+            if index.depends_on(_dep, dep):
                 return True
         return False
 
     def depends_on(self, dep):
         self.get_data()
-        if self.base == dep:
-            return True
-        for _dep in self.deps or []:
-            if _dep == dep or _dep.depends_on(dep):
-                return True
-        if self.base:
-            if self.base.depends_on(dep):
-                return True
-        return False
-
-    def collect_dot_deps(self, outset):
-        self.get_data()
-        if self.base:
-            outset.update(self.base.collect_dot_deps(outset))
-            if not self.deps_depend_on(self.base):
-                outset.add('"%s" -> "%s"' % (self.name_and_pr(), self.base))
-        for dep in self.deps or []:
-            dep.get_data()
-            outset.add('"%s" -> "%s"' % (self.name_and_pr(), dep.name_and_pr()))
-            outset.update(dep.collect_dot_deps(outset))
+        return self.repo.get_graph().get_index().depends_on(self, dep)
+
+    def collect_dot_deps(self, outset, seen=None):
+        # adds (source, target, kind) edges of this branch's subgraph to
+        # <outset>, visiting every branch only once
+        if seen is None:
+            seen = set()
+        index = self.repo.get_graph().get_index()
+        todo = [self]
+        while todo:
+            branch = todo.pop()
+            if branch in seen:
+                continue
+            seen.add(branch)
+            branch.get_data()
+            if branch.base:
+                todo.append(branch.base)
+                if branch.base in index.reduced_inputs(branch):
+                    outset.add(
+                        (branch.name_and_pr(), branch.base.name_and_pr(), "base")
+                    )
+            for dep in branch.deps or []:
+                outset.add((branch.name_and_pr(), dep.name_and_pr(), "dep"))
+                todo.append(dep)
 
         return outset
 
@@ -443,17 +859,15 @@ class Branch(object):
         print("regit: exporting %s to %s..." % (self.name, name))
 
         self.get_data()
-        branch = Branch.maybe_new(name)
-        Branch.switch(branch, self.base)
+        branch = self.repo.maybe_new(name)
+        self.repo.switch(branch, self.base)
 
         if self.deps:
-            cmd_check(
+            self.repo.check(
                 '( cd "%s" ; git diff %s..%s | git apply --index )'
-                % (topdir, self.base.name, merge_base)
+                % (self.repo.topdir, self.base.name, merge_base)
             )
 
-            bfile = self.branch_file()
-
             commit_message = (
                 "DEPENDENCY COMMIT\n\n"
                 "This commit contains the following dependencies:\n\n"
@@ -462,9 +876,9 @@ class Branch(object):
             if self.base:
                 commit_message = commit_message + "\nBase branch: %s" % self.base
 
-            git_command(["commit", "-m", commit_message])
+            self.repo.command(["commit", "-m", commit_message])
 
-        cmd_check(
+        self.repo.check(
             "git format-patch %s..%s --stdout | git am --ignore-whitespace"
             % (merge_base, self.name)
         )
@@ -479,15 +893,15 @@ class Branch(object):
         return out
 
     def squash_deps(self):
-        if Branch.current.name != self.name:
+        if self.repo.current.name != self.name:
             print("regit: error: squash_deps called from wrong active branch!")
-            print(Branch.current, self)
+            print(self.repo.current, self)
             return False
 
         self.export(self.tmp_name())
-        Branch.switch(self)
-        git_command(["reset", "--hard", "refs/heads/%s" % self.tmp_name()])
-        git_command(["branch", "-D", self.tmp_name()])
+        self.repo.switch(self)
+        self.repo.command(["reset", "--hard", "refs/heads/%s" % self.tmp_name()])
+        self.repo.command(["branch", "-D", self.tmp_name()])
 
     def update_branch_file(self, bdict=None):
         if not bdict:
@@ -498,19 +912,19 @@ class Branch(object):
             }
             if self.pr is not None:
                 bdict["pr"] = self.pr
+            if self.tips:
+                bdict["tips"] = self.tips
 
-        json.dump(bdict, open(self.branch_file(), "w"))
-
-    def branch_file(self):
-        branch_name = self.name.replace("/", "__")
+        self.repo.get_store().write(self.name, bdict)
 
-        return os.path.join(topdir, ".git/regit/branches/%s" % branch_name)
+    def read_branch_file(self):
+        return self.repo.get_store().read(self.name)
 
     def delete(self):
-        if Branch.current == self:
+        if self.repo.current == self:
             _err("regit: error: tried to delete current branch.")
 
-        git_command(["branch", "-D", self.name])
+        self.repo.command(["branch", "-D", self.name])
 
     def delete_deps(self, deps):
         self.get_data()
@@ -537,8 +951,8 @@ class Branch(object):
                 change = True
 
         if change:
+            self.repo.get_graph().changed()
             self.update_branch_file()
-            self.have_data = False
 
     def check_unmanaged_deps(self, base=None):
         self.get_data()
@@ -566,100 +980,438 @@ class Branch(object):
         return res
 
 
-#    def can_merge(s, other):
-#        old_branch = Branch.current
-#        old_head = s.head()
-#        Branch.switch(s)
-
-
-def get_rebase_head_name():
-    f = os.path.join(topdir, ".git/rebase-apply/head-name")
-    if os.path.isfile(f):
-        return open(f, "r").readline().rstrip()
-    else:
-        return None
-
-
-def str_list(list):
-    res = []
-    for x in list or []:
-        res.append(str(x))
-    return res
+class DependencyGraph(object):
+    def __init__(self, repo):
+        self.repo = repo
+        self.branches = []
+        self.map = {}
+        # per-invocation caches. "missing" is keyed by commit ids and stays
+        # valid forever, "tips" and "stale" are dropped whenever git writes.
+        self.tips = {}
+        self.stale = {}
+        self.missing = {}
+        self.commits = None
+        self.closures = {}
+        self.cache = None
+        self.index = None
+        self.reverse = None
+
+    def load(self):
+        # read every record in one pass, so that references are resolved and
+        # validated (and warnings printed) once per invocation.
+        records = self.repo.get_store().read_all(str_list(self.repo.list))
+
+        for branch in self.repo.list:
+            bdict = records.get(branch.name)
+            if bdict is None:
+                continue
+            branch.set_data(bdict)
+            self.branches.append(branch)
+            self.map[branch.name] = branch
+
+    def is_managed(self, branch):
+        return branch.name in self.map
+
+    def remove(self, branch):
+        if self.is_managed(branch):
+            self.branches.remove(branch)
+            del self.map[branch.name]
+        self.changed()
+
+    def get_index(self):
+        if self.index is None:
+            self.index = ReachabilityIndex(self)
+        return self.index
+
+    def changed(self):
+        # the structure of the graph changed
+        self.index = None
+        self.reverse = None
+        self.invalidate()
+
+    def get_reverse(self):
+        # branch -> managed branches that have it as base or dependency
+        if self.reverse is None:
+            self.reverse = {}
+            for branch in self.branches:
+                for other in self.inputs(branch):
+                    self.reverse.setdefault(other, []).append(branch)
+        return self.reverse
+
+    def dependents(self, branch, recursive=False):
+        # direct dependents by name, all (transitive) ones in topological order
+        if recursive:
+            return self.get_index().get_descendants(branch)
+        return sorted(self.get_reverse().get(branch, []), key=lambda x: x.name)
+
+    def invalidate(self):
+        self.tips = {}
+        self.stale = {}
+        self.closures = {}
+
+    def get_cache(self):
+        if self.cache is None:
+            from regit.cache import StatusCache
+
+            self.cache = StatusCache(self.repo.status_cache_file())
+            self.cache.load()
+        return self.cache
+
+    def save_cache(self):
+        if self.cache:
+            if not self.tips:
+                self.load_tips()
+            self.cache.save(self.tips.values())
+
+    def closure(self, branch):
+        # the branch and everything it is (transitively) based on or depends on
+        res = self.closures.get(branch.name)
+        if res is None:
+            res = set(self.get_index().get_ancestors(branch))
+            res.add(branch)
+            self.closures[branch.name] = res
+        return res
 
+    def closure_key(self, branch):
+        # what needs_update() of <branch> is computed from: the tip, base and
+        # deps of every branch in its closure
+        return {
+            other.name: [
+                self.tip(other),
+                other.base and other.base.name,
+                sorted(str_list(other.deps or [])),
+            ]
+            for other in self.closure(branch)
+        }
 
-def git_command_output(cmd):
-    git = ["git"]
-    git.extend(cmd)
-    return subprocess.check_output(
-        git, universal_newlines=True, stderr=subprocess.DEVNULL
-    )
+    def inputs(self, branch):
+        res = []
+        if branch.base:
+            res.append(branch.base)
+        return res + (branch.deps or [])
+
+    def topo_order(self):
+        # managed branches ordered so that every branch comes after its base
+        # and dependencies
+        order = []
+        done = set()
+        visiting = set()
+
+        for branch in self.branches:
+            if branch in done:
+                continue
+            stack = [(branch, iter(self.inputs(branch)))]
+            visiting.add(branch)
+            while stack:
+                node, inputs = stack[-1]
+                for other in inputs:
+                    if other in done or not self.is_managed(other):
+                        continue
+                    if other in visiting:
+                        _err(
+                            'regit: error: dependency cycle between "%s" and "%s".'
+                            % (node, other)
+                        )
+                    visiting.add(other)
+                    stack.append((other, iter(self.inputs(other))))
+                    break
+                else:
+                    stack.pop()
+                    visiting.remove(node)
+                    done.add(node)
+                    order.append(node)
+
+        return order
+
+    def layers(self):
+        # topo_order(), grouped so that branches in the same layer don't depend
+        # on each other
+        depth = {}
+        layers = []
+        for branch in self.topo_order():
+            d = 0
+            for other in self.inputs(branch):
+                if other in depth:
+                    d = max(d, depth[other] + 1)
+            depth[branch] = d
+            if d == len(layers):
+                layers.append([])
+            layers[d].append(branch)
+
+        return layers
+
+    def load_tips(self):
+        for branch in self.repo.list:
+            tip = branch.head()
+            if tip:
+                self.tips[branch.name] = tip
+
+    def tip(self, branch):
+        if not self.tips:
+            self.load_tips()
+        tip = self.tips.get(branch.name)
+        if tip is None:
+            tip = branch.head()
+            self.tips[branch.name] = tip
+        return tip
+
+    def get_commits(self):
+        if self.commits is None:
+            tips = set()
+            for branch in self.branches:
+                tips.add(self.tip(branch))
+                for other in [branch.base] + branch.deps:
+                    tips.add(self.tip(other))
+            self.commits = CommitIndex(self.repo.git, tips)
+        return self.commits
+
+    def known_stale(self, branch):
+        # needs_update() of <branch>, if known without looking at commits
+        res = self.stale.get(branch.name)
+        if res is None:
+            res = self.get_cache().get_stale(branch.name, self.closure_key(branch))
+            if res is not None:
+                self.stale[branch.name] = res
+        return res
 
+    def known_missing(self, key):
+        # missing_from() for a pair of tips, if the cache or the commit index
+        # can answer it
+        res = self.missing.get(key)
+        if res is None:
+            cache = self.get_cache()
+            res = cache.get_missing(*key)
+            if res is None:
+                res = self.get_commits().missing(*key)
+                if res is not None:
+                    cache.set_missing(key[0], key[1], res)
+            if res is not None:
+                self.missing[key] = res
+        return res
 
-def git_command(cmd, quiet=False):
-    git = ["git"]
-    git.extend(cmd)
-    if quiet:
-        out = subprocess.DEVNULL
-        err = subprocess.DEVNULL
-    else:
-        out = sys.stdout
-        err = sys.stderr
+    # return true if a is missing commits from b
+    def missing_from(self, a, b):
+        key = (self.tip(a), self.tip(b))
+        res = self.known_missing(key)
+        if res is None:
+            res = self.repo.branch_missing_commits(*key)
+            self.get_cache().set_missing(key[0], key[1], res)
+            self.missing[key] = res
+        return res
 
-    return subprocess.check_call(git, stdout=out, stderr=err)
+    def prefetch(self, branches, jobs=None, indirect=False):
+        # Asks git about every tip pair that needs_update() and the status
+        # output of <branches> will need and neither the cache nor the commit
+        # index can answer, all at once instead of one after another. The
+        # answers land in self.missing, so later missing_from() calls (and
+        # what gets printed) are unchanged. <indirect>: the output also
+        # compares each branch with its indirect dependencies.
+        pairs = set()
+        if indirect:
+            for branch in branches:
+                if self.is_managed(branch):
+                    for other in branch.get_deps(True, False):
+                        pairs.add((branch, other))
+
+        seen = set()
+        todo = list(branches)
+        while todo:
+            branch = todo.pop()
+            if branch in seen or not self.is_managed(branch):
+                continue
+            seen.add(branch)
+
+            if branch.base:
+                pairs.add((branch.base, branch))
+            if not branch.inputs_unchanged():
+                for other in self.inputs(branch):
+                    pairs.add((branch, other))
+
+            # status asks the deps whether they need an update, needs_update()
+            # only recurses if the answer is not known already
+            todo.extend(branch.deps or [])
+            if branch.base and self.known_stale(branch) is None:
+                todo.append(branch.base)
+
+        keys = set()
+        for a, b in pairs:
+            key = (self.tip(a), self.tip(b))
+            if None not in key and self.known_missing(key) is None:
+                keys.add(key)
+        if len(keys) < 2:
+            return
 
+        from regit import query
 
-def _err(string):
-    print(string, file=sys.stderr)
-    sys.exit(1)
+        keys = sorted(keys)
+        outs = query.outputs(
+            self.repo.git, [missing_commits_cmd(*key) for key in keys], jobs
+        )
+        cache = self.get_cache()
+        for key, out in zip(keys, outs):
+            res = bool(out.strip())
+            cache.set_missing(key[0], key[1], res)
+            self.missing[key] = res
+
+
+class ReachabilityIndex(object):
+    # Ancestor and descendant bitsets (one bit per branch, assigned in
+    # topological order) over the base and deps edges, plus ancestors over
+    # deps edges only. Built once per graph, answers depends_on() and
+    # friends with a few integer operations. Building it fails on cycles.
+    def __init__(self, graph):
+        self.graph = graph
+        self.nodes = []
+        self.bit = {}
+        self.ancestors = {}
+        self.dep_ancestors = {}
+        self.descendants = {}
+
+        order = graph.topo_order()
+        for branch in order:
+            ancestors = 0
+            for other in graph.inputs(branch):
+                ancestors |= self.get_bit(other) | self.ancestors.get(other, 0)
+            dep_ancestors = 0
+            for dep in branch.deps or []:
+                dep_ancestors |= self.get_bit(dep) | self.dep_ancestors.get(dep, 0)
+            self.get_bit(branch)
+            self.ancestors[branch] = ancestors
+            self.dep_ancestors[branch] = dep_ancestors
+
+        for branch in reversed(order):
+            mine = self.descendants.get(branch, 0) | self.bit[branch]
+            for other in graph.inputs(branch):
+                self.descendants[other] = self.descendants.get(other, 0) | mine
+
+    def get_bit(self, branch):
+        bit = self.bit.get(branch)
+        if bit is None:
+            bit = 1 << len(self.nodes)
+            self.bit[branch] = bit
+            self.nodes.append(branch)
+        return bit
+
+    def branches(self, bits):
+        res = []
+        n = 0
+        while bits:
+            if bits & 1:
+                res.append(self.nodes[n])
+            bits >>= 1
+            n += 1
+        return res
 
+    def depends_on(self, branch, other):
+        # true if <branch> is (transitively) based on or depends on <other>
+        return bool(self.ancestors.get(branch, 0) & self.bit.get(other, 0))
+
+    def get_ancestors(self, branch):
+        return self.branches(self.ancestors.get(branch, 0))
+
+    def get_descendants(self, branch):
+        return self.branches(self.descendants.get(branch, 0))
+
+    def reduced_inputs(self, branch):
+        # transitive reduction: the inputs of <branch> that are not already
+        # reachable through one of its other inputs
+        inputs = self.graph.inputs(branch)
+        covered = 0
+        for other in inputs:
+            covered |= self.ancestors.get(other, 0)
+        return [x for x in inputs if not covered & self.bit.get(x, 0)]
+
+
+class CommitIndex(object):
+    # The commits reachable from a set of tips, down to (excluding) their
+    # common merge base, loaded with a handful of git calls. Answers the
+    # "a is missing commits from b" question for any pair of those tips in
+    # memory. Falls back (returns None) for commits it doesn't know about.
+    max_commits = 100000
+
+    def __init__(self, git, tips):
+        self.git = git
+        self.tips = set(tips)
+        self.parents = {}
+        self.dependency_updates = set()
+        self.ancestors = {}
+        self.valid = False
+
+        if not self.tips:
+            return
 
-def state_file():
-    return os.path.join(topdir, ".git/regit/state")
+        tips = sorted(self.tips)
+        try:
+            bases = self.git.output(["merge-base", "--octopus"] + tips).split()
+        except subprocess.CalledProcessError:
+            # unrelated histories
+            return
 
+        revs = tips + ["^%s" % base for base in bases]
+        out = self.git.output(
+            ["rev-list", "--parents", "--max-count=%s" % (self.max_commits + 1)]
+            + revs
+        )
+        lines = out.splitlines()
+        if len(lines) > self.max_commits:
+            return
 
-def load_state():
-    try:
-        statefile = open(state_file(), "r")
-    except:
-        return None
+        for line in lines:
+            commit = line.split()
+            self.parents[commit[0]] = commit[1:]
+
+        out = self.git.output(["rev-list", "--grep=^DEPENDENCY UPDATE"] + revs)
+        self.dependency_updates = set(out.split())
+        self.valid = True
+
+    def knows(self, commit):
+        # only the tips the index was built from: the history below any other
+        # commit may reach past the merge base, where the index stops
+        return commit in self.tips
+
+    def get_ancestors(self, commit):
+        res = self.ancestors.get(commit)
+        if res is None:
+            res = set()
+            todo = [commit]
+            while todo:
+                c = todo.pop()
+                if c in res or c not in self.parents:
+                    continue
+                res.add(c)
+                todo.extend(self.parents[c])
+            self.ancestors[commit] = res
+        return res
 
-    try:
-        return json.load(statefile)
-    except ValueError:
-        return None
+    def missing(self, a, b):
+        if not (self.valid and self.knows(a) and self.knows(b)):
+            return None
 
+        have = self.get_ancestors(a)
+        seen = set()
+        todo = [b]
+        while todo:
+            c = todo.pop()
+            if c in seen or c in have or c not in self.parents:
+                continue
+            seen.add(c)
+            if c not in self.dependency_updates:
+                return True
+            todo.extend(self.parents[c])
 
-def cmd_check(cmd):
-    try:
-        subprocess.check_output(cmd, shell=True)
-        return True
-    except subprocess.CalledProcessError:
         return False
 
 
-# return true if a is missing commits from b
-def branch_missing_commits(a, b):
-    return cmd_check(
-        'test -n "$(git log --invert-grep --grep="^DEPENDENCY UPDATE" %s..%s)"' % (a, b)
-    )
-
-
-def git_workdir_clean():
-    return cmd_check("test -z \"$(git status --porcelain -s | grep -v '^??')\"")
-
-
-def is_automerge_complete():
-    return cmd_check(
-        "test -z \"$(git status --porcelain -s | grep -vE '(^[ADMR]  )' | grep -v '^??')\""
-    )
+def str_list(list):
+    res = []
+    for x in list or []:
+        res.append(str(x))
+    return res
 
 
-def rev_parse(ref):
-    try:
-        ref = git_command_output(["rev-parse", ref])
-        return ref.rstrip()
-    except subprocess.CalledProcessError:
-        return None
+def _err(string):
+    print(string, file=sys.stderr)
+    sys.exit(1)
 
 
 def print_dependency_status(branch, deps):
@@ -678,31 +1430,83 @@ def print_dependency_status(branch, deps):
                 print("%s" % dep.name_and_pr(), _tmp)
 
 
-def status(args):
-    if not git_workdir_clean():
-        _err("regit: workdir unclean. Please, commit your changes or stash them.")
+def status_record(branch):
+    graph = repo.get_graph()
 
-    Branch.get(True)
-    start_branch = Branch.current
+    def dep_record(dep):
+        return {
+            "name": dep.name,
+            "pr": dep.pr,
+            "tip": graph.tip(dep),
+            "missing": branch.missing_from(dep),
+            "needs_update": dep.needs_update(),
+            "part_of_base": bool(dep.base and not dep.base.missing_from(dep)),
+        }
+
+    record = {
+        "name": branch.name,
+        "pr": branch.pr,
+        "tip": graph.tip(branch),
+        "needs_update": branch.needs_update(),
+        "base": None,
+        "deps": [dep_record(dep) for dep in branch.get_deps() or []],
+        "indirect_deps": [dep_record(dep) for dep in branch.get_deps(True, False)],
+    }
+    if branch.base:
+        record["base"] = {
+            "name": branch.base.name,
+            "tip": graph.tip(branch.base),
+            "missing": branch.missing_from(branch.base),
+            "contains_branch": not branch.base.missing_from(branch),
+        }
+
+    return record
+
+
+def status(args):
+    repo.load_branches(True)
+    graph = repo.get_graph()
 
     to_check = None
     if args.all:
-        to_check = Branch.list
+        to_check = repo.list
+    elif repo.current:
+        to_check = [repo.current]
     else:
-        to_check = [Branch.current]
+        _err("regit: HEAD is detached, use --all or check out a branch.")
+
+    if args.dot:
+        args.format = "dot"
+    if args.show and not args.format:
+        args.format = "html"
 
-    if args.show:
-        args.dot = True
+    if not args.format:
+        indirect = args.recursive_deps or args.json or args.ndjson
+        graph.prefetch(to_check, args.jobs, indirect)
+
+    if args.json:
+        print("[", flush=True)
 
     dot_set = set()
+    seen = set()
+    first = True
     for branch in to_check:
-        if not branch.has_branchfile():
+        if not graph.is_managed(branch):
             continue
         name = branch.name
         if name.startswith("regit/"):
             continue
-        Branch.switch(branch)
-        if not args.dot:
+        if args.json or args.ndjson:
+            # one record per branch, printed as soon as it is evaluated
+            record = json.dumps(status_record(branch))
+            if args.json:
+                if not first:
+                    record = ",\n" + record
+                print(record, end="", flush=True)
+            else:
+                print(record, flush=True)
+            first = False
+        elif not args.format:
             if not branch.needs_update():
                 print("regit: branch", branch.name_and_pr(), "is up to date.")
                 if branch.base and not branch.base.missing_from(branch):
@@ -719,30 +1523,145 @@ def status(args):
                 print("  indirect dependencies:")
                 print_dependency_status(branch, _deps)
         else:
-            branch.collect_dot_deps(dot_set)
-    if args.dot:
-        outfile = sys.stdout
-        if args.show:
-            fd, outfile_name = tempfile.mkstemp(suffix=".dot")
-            outfile = os.fdopen(fd, "w")
+            branch.collect_dot_deps(dot_set, seen)
+    if args.json:
+        print("\n]")
+    elif args.format:
+        from regit import render
 
-        print('digraph "regit branch dependencies" {', file=outfile)
-        for entry in sorted(dot_set):
-            print(entry, file=outfile)
-        print("}", file=outfile)
+        out = render.render(dot_set, args.format)
         if args.show:
-            outfile.close()
-            pdf = outfile_name + ".pdf"
-            cmd_check("cat %s | dot -Tpdf > %s" % (outfile_name, pdf))
-            try:
-                cmd_check("xdg-open %s" % pdf)
-            except subprocess.CalledProcessError:
-                pass
-            os.unlink(outfile_name)
-            os.unlink(pdf)
+            import webbrowser
+
+            # overwritten by the next --show, so nothing piles up in /tmp
+            outfile_name = repo.graph_file(args.format)
+            os.makedirs(os.path.dirname(outfile_name), exist_ok=True)
+            with open(outfile_name, "w") as outfile:
+                outfile.write(out)
+            print("regit: wrote %s" % outfile_name)
+            webbrowser.open("file://" + outfile_name)
+        else:
+            sys.stdout.write(out)
 
-    if Branch.current != start_branch:
-        Branch.switch(start_branch)
+    graph.save_cache()
+
+
+def cache(args):
+    from regit.cache import StatusCache
+
+    status_cache = StatusCache(repo.status_cache_file())
+    status_cache.load()
+
+    if args.action == "clear":
+        status_cache.clear()
+        print("regit: status cache cleared.")
+        return
+
+    lookups = status_cache.hits + status_cache.misses
+    rate = 0
+    if lookups:
+        rate = 100.0 * status_cache.hits / lookups
+    size = 0
+    if os.path.isfile(status_cache.path):
+        size = os.path.getsize(status_cache.path)
+
+    print("Cache file..:", status_cache.path, "(%s bytes)" % size)
+    print("Branches....:", len(status_cache.stale))
+    print("Pairs.......:", len(status_cache.missing))
+    print("Hits........:", status_cache.hits)
+    print("Misses......:", status_cache.misses)
+    print("Hit rate....: %.1f%%" % rate)
+
+
+def migrate(args):
+    repo.load_branches(True)
+
+    source = repo.get_store()
+    if args.to == "file":
+        target = store.FileStore(repo.store_file())
+    elif args.to == "ref":
+        target = store.RefStore(repo.git)
+    else:
+        target = store.DirStore(repo.branch_dir())
+
+    if type(source) == type(target):
+        print("regit: branch records are already stored in %s." % source.path)
+        return
+
+    # all records, also those of branches that don't exist here (anymore)
+    records = source.read_all()
+    target.write_all(records)
+    source.remove(list(records))
+
+    print("regit: moved %s branch records to %s." % (len(records), target.path))
+
+
+def daemon(args):
+    from regit import daemon
+
+    if args.stop:
+        if daemon.query(repo.daemon_socket(), ["daemon", "--stop"]) is None:
+            _err("regit: no daemon running.")
+        print("regit: daemon stopped.")
+        return
+
+    try:
+        daemon.serve(repo, poll=args.poll)
+    except RuntimeError as e:
+        _err("regit: %s" % e)
+    except KeyboardInterrupt:
+        pass
+
+
+def workspace(args):
+    import time
+
+    from regit import workspace
+
+    patterns = list(args.repos)
+    if args.manifest:
+        try:
+            patterns.extend(workspace.read_manifest(args.manifest))
+        except OSError as e:
+            _err("regit: cannot read manifest: %s" % e)
+    if not patterns:
+        _err("regit: no repositories given (list them or use --manifest).")
+
+    paths = workspace.find_repositories(patterns)
+    jobs = max(1, args.jobs or os.cpu_count() or 1)
+
+    start = time.monotonic()
+    results = workspace.run_all(paths, [args.action, "--all"], jobs)
+    elapsed = time.monotonic() - start
+
+    failed = [path for path, returncode, output, seconds in results if returncode]
+    if args.json:
+        records = [
+            {
+                "repository": path,
+                "success": returncode == 0,
+                "returncode": returncode,
+                "seconds": round(seconds, 3),
+                "output": output,
+            }
+            for path, returncode, output, seconds in results
+        ]
+        print(json.dumps(records, indent=2))
+    else:
+        for path, returncode, output, seconds in results:
+            print(
+                "regit: %s: %s (%.2fs)"
+                % (os.path.relpath(path), "failed" if returncode else "ok", seconds)
+            )
+            for line in output.splitlines():
+                print("    " + line)
+        print(
+            "regit: %s of %s repositories ok, %s failed (%.2fs, %s at a time)."
+            % (len(results) - len(failed), len(results), len(failed), elapsed, jobs)
+        )
+
+    if failed:
+        sys.exit(1)
 
 
 def listify(something):
@@ -753,78 +1672,248 @@ def listify(something):
     return something
 
 
-def name_to_branch(list):
-    list = listify(list)
-    res = []
-    for x in list:
-        _tmp = Branch.map.get(x)
-        if _tmp:
-            res.append(_tmp)
-    return res
-
-
 # Command line handler
 
 
 def update(args):
-    global current
-    global branches
-
-    if not git_workdir_clean():
+    if not repo.workdir_clean():
         _err("regit: workdir unclean. Please, commit your changes or stash them.")
 
-    Branch.get()
-    to_update = Branch.current
-    if to_update.check_unmanaged_deps(Branch.current.base):
+    repo.load_branches()
+
+    to_update = None
+    if args.source:
+        if args.all:
+            _err("regit: --from and --all cannot be combined.")
+        source = repo.map.get(args.source)
+        if not source:
+            _err('regit: unknown branch "%s".' % args.source)
+        to_update = repo.get_graph().dependents(source, True)
+        print(
+            'regit: updating %s branch(es) depending on "%s".'
+            % (len(to_update), source)
+        )
+
+    if args.jobs > 1:
+        if not (args.all or args.source):
+            _err("regit: --jobs needs --all or --from.")
+        update_parallel(args.jobs, to_update)
+        repo.prune_merge_cache()
+        return
+
+    if args.all or args.source:
+        update_all(to_update)
+        repo.prune_merge_cache()
+        return
+
+    to_update = repo.current
+    if to_update.check_unmanaged_deps(repo.current.base):
         to_update.update(False, args.recursive)
 
+    repo.prune_merge_cache()
+
+
+def update_all(to_update=None):
+    # updates <to_update> (default: all managed branches) in topological order
+    start_branch = repo.current
+    graph = repo.get_graph()
+
+    if to_update is not None:
+        to_update = set(to_update)
+    graph.prefetch(graph.branches if to_update is None else to_update)
+
+    updated = []
+    for branch in graph.topo_order():
+        if to_update is not None and branch not in to_update:
+            continue
+        if branch.name.startswith("regit/"):
+            continue
+        if not branch.needs_update():
+            continue
+        if not branch.check_unmanaged_deps(branch.base):
+            print('regit: skipping branch "%s".' % branch)
+            continue
+        if branch.checked_out_elsewhere():
+            print(
+                'regit: skipping branch "%s", it is checked out in %s.'
+                % (branch, branch.worktree)
+            )
+            continue
+
+        branch.update()
+        updated.append(branch)
+
+    if repo.current != start_branch:
+        repo.switch(start_branch)
+
+    print(
+        "regit: updated %s of %s managed branches."
+        % (len(updated), len(graph.branches))
+    )
+
+
+def update_parallel(jobs, to_update=None):
+    from regit import parallel
+
+    start_branch = repo.current
+    graph = repo.get_graph()
+
+    failed = set()
+    blocked = {}
+    updated = []
+    if to_update is not None:
+        to_update = set(to_update)
+
+    for layer in graph.layers():
+        graph.prefetch([x for x in layer if to_update is None or x in to_update])
+
+        todo = []
+        for branch in layer:
+            if to_update is not None and branch not in to_update:
+                continue
+            if branch.name.startswith("regit/"):
+                continue
+            if branch in blocked:
+                print(
+                    'regit: skipping branch "%s", "%s" failed to update.'
+                    % (branch, blocked[branch])
+                )
+                continue
+            if not branch.needs_update():
+                continue
+            if not branch.check_unmanaged_deps(branch.base):
+                print('regit: skipping branch "%s".' % branch)
+                continue
+            if branch.checked_out_elsewhere():
+                print(
+                    'regit: skipping branch "%s", it is checked out in %s.'
+                    % (branch, branch.worktree)
+                )
+                continue
+            todo.append(branch)
+
+        def fail(branch, message):
+            print(message)
+            failed.add(branch)
+            for other in graph.dependents(branch, True):
+                blocked.setdefault(other, branch)
+
+        # in memory first, all of the layer at once
+        to_merge = [x.deps_to_merge(x.deps or []) for x in todo]
+        work = [x.in_memory_job(merges) for x, merges in zip(todo, to_merge)]
+        results = parallel.build_in_memory(repo.git, [job for job, _ in work], jobs)
+
+        # the checked out branch cannot go into a linked worktree
+        in_worktrees = []
+        in_here = None
+        for branch, merges, (job, messages), res in zip(todo, to_merge, work, results):
+            print('regit: updating branch "%s"...' % branch)
+            for line in messages:
+                print("    " + line)
+            try:
+                done = branch.finish_in_memory(branch.deps, merges, job, res)
+            except subprocess.CalledProcessError as e:
+                fail(branch, 'regit: updating "%s" failed: %s' % (branch, e))
+                continue
+            if done:
+                updated.append(branch)
+            elif branch == start_branch:
+                in_here = branch
+            else:
+                in_worktrees.append(branch)
+
+        if in_worktrees:
+            print(
+                "regit: updating %s in worktrees..." % ", ".join(str_list(in_worktrees)),
+            )
+        results = parallel.update_branches(
+            repo.git, str_list(in_worktrees), repo.worktree_dir(), jobs
+        )
+        for name, success, output in results:
+            print('regit: branch "%s":' % name)
+            for line in output.splitlines():
+                print("    " + line)
+            branch = repo.map[name]
+            if success:
+                updated.append(branch)
+            else:
+                path = parallel.worktree_path(repo.worktree_dir(), name)
+                fail(
+                    branch,
+                    'regit: updating "%s" failed. resolve in %s, run "git dep --continue"'
+                    "\nregit: there, then remove it (git worktree remove %s)."
+                    % (name, path, path),
+                )
+
+        repo.git.reset()
+        repo.invalidate()
+
+        if in_here:
+            try:
+                in_here.update()
+                updated.append(in_here)
+            except SystemExit:
+                # stopped for conflict resolution, the state is saved
+                fail(in_here, 'regit: updating "%s" failed, see above.' % in_here)
+            repo.git.reset()
+            repo.invalidate()
+
+    print(
+        "regit: updated %s of %s managed branches, %s failed, %s skipped."
+        % (len(updated), len(graph.branches), len(failed), len(blocked))
+    )
+    if failed:
+        sys.exit(1)
+
 
 def export(args):
-    Branch.get()
-    Branch.current.export(args.name)
+    repo.load_branches()
+    repo.current.export(args.name)
 
 
 def init(args):
-    Branch.get()
-    if Branch.current is None:
+    repo.load_branches()
+    if repo.current is None:
         _err("regit: cannot determine current branch")
 
-    if os.path.isfile(Branch.current.branch_file()):
+    if repo.current.has_branchfile():
         _err(
-            "regit: error: branch dependency file (%s) already exists."
-            % Branch.current.branch_file()
+            "regit: error: branch %s already has dependency information."
+            % repo.current
         )
 
-    base = Branch.map.get(args.base)
+    base = repo.map.get(args.base)
     if not base:
         _err('regit: base branch "%s" unknown. exiting.' % args.base)
 
-    rebase_tip = Branch.current.merge_base(base)
+    rebase_tip = repo.current.merge_base(base)
 
     if rebase_tip != base.head():
-        _err("regit: branch %s needs rebase to %s!" % (Branch.current, base))
+        _err("regit: branch %s needs rebase to %s!" % (repo.current, base))
 
     bdict = {"base": args.base, "deps": args.depends_on, "rebase_tip": rebase_tip}
-    Branch.current.update_branch_file(bdict)
+    repo.current.update_branch_file(bdict)
 
 
 def add(args):
-    Branch.get()
-    f = open(Branch.current.branch_file(), "r")
-    bdict = json.load(f)
+    repo.load_branches()
+    bdict = repo.current.read_branch_file()
+    if bdict is None:
+        _err("regit: branch %s is not managed by regit." % repo.current)
     deps = bdict.get("deps") or []
     for d in args.dep:
         if not d in deps:
             deps.append(d)
     bdict["deps"] = deps
 
-    Branch.current.update_branch_file(bdict)
+    repo.current.update_branch_file(bdict)
 
 
 def ddel(args):
-    Branch.get()
-    f = open(Branch.current.branch_file(), "r")
-    bdict = json.load(f)
+    repo.load_branches()
+    bdict = repo.current.read_branch_file()
+    if bdict is None:
+        _err("regit: branch %s is not managed by regit." % repo.current)
     _deps = bdict.get("deps") or []
     deps = []
     for d in _deps:
@@ -832,22 +1921,23 @@ def ddel(args):
             deps.append(d)
     bdict["deps"] = deps
 
-    Branch.current.update_branch_file(bdict)
+    repo.current.update_branch_file(bdict)
 
 
 def dset(args):
-    Branch.get()
-    f = open(Branch.current.branch_file(), "r")
-    bdict = json.load(f)
+    repo.load_branches()
+    bdict = repo.current.read_branch_file()
+    if bdict is None:
+        _err("regit: branch %s is not managed by regit." % repo.current)
     bdict["deps"] = args.dep
 
-    Branch.current.update_branch_file(bdict)
+    repo.current.update_branch_file(bdict)
 
 
 def show(args):
-    Branch.get()
+    repo.load_branches()
 
-    b = Branch.current
+    b = repo.current
     if not b.has_branchfile():
         print("regit: branch %s is not managed by regit." % b)
         return
@@ -856,9 +1946,6 @@ def show(args):
     for dep in b.deps or []:
         dep.get_data()
 
-    if Branch.current != b:
-        Branch.switch(b)
-
     print("Branch......:", b.name_and_pr())
     print("Base........:", b.base)
     print("Dependencies:", ", ".join([x.name_and_pr() for x in b.deps or []]))
@@ -866,49 +1953,57 @@ def show(args):
 
 
 def delete_branch(args):
-    Branch.get()
+    repo.load_branches()
 
-    b = Branch.current
+    b = repo.current
 
     for branch_name in args.branch:
-        branch = Branch.map.get(branch_name)
+        branch = repo.map.get(branch_name)
         if not branch:
             print("regit: cannot delete nonexistent branch", branch_name)
             continue
-        if branch == Branch.current:
+        if branch == repo.current:
             print("regit: cannot remove currently active branch.")
             continue
 
         print("regit: deleting branch %s" % branch)
 
-        branch.get_data()
-
-        for other in Branch.list:
-            if other == branch:
-                continue
-            if not other.has_branchfile():
-                continue
-
+        graph = repo.get_graph()
+        for other in graph.dependents(branch):
             other.delete_deps(branch)
-        try:
-            os.unlink(branch.branch_file())
-        except FileNotFoundError:
-            pass
+        repo.get_store().delete(branch.name)
+        graph.remove(branch)
 
         branch.delete()
 
-    Branch.switch(b)
+    repo.switch(b)
+
+
+def dependents(args):
+    repo.load_branches(True)
+    graph = repo.get_graph()
+
+    branch = repo.current
+    if args.branch:
+        branch = repo.map.get(args.branch)
+        if not branch:
+            _err('regit: unknown branch "%s".' % args.branch)
+    elif not branch:
+        _err("regit: HEAD is detached, please name a branch.")
+
+    for other in graph.dependents(branch, args.recursive):
+        print(other)
 
 
 def handle_state(args):
-    state = load_state()
+    state = repo.load_state()
     if state:
-        os.unlink(state_file())
+        os.unlink(repo.state_file())
         action = state.get("action")
         if action == "update":
             phase = state.get("phase")
-            Branch.get(True)
-            branch = name_to_branch(state.get("branch"))[0]
+            repo.load_branches(True)
+            branch = repo.name_to_branch(state.get("branch"))[0]
 
             if args.cont:
                 branch.get_data()
@@ -929,7 +2024,7 @@ def handle_state(args):
         else:
             _err('regit: error: update: tree is in a running "%s" operation.' % action)
     else:
-        _err("regit: error while parsing statefile (%s)" % (state_file()))
+        _err("regit: error while parsing statefile (%s)" % (repo.state_file()))
 
 
 def set_rebase_tip(args):
@@ -943,14 +2038,14 @@ def set_rebase_tip(args):
             "regit: set-rebase-tip: only commit reference *or* --base/-b can be specified!"
         )
 
-    Branch.get()
-    b = Branch.current
+    repo.load_branches()
+    b = repo.current
     b.get_data()
 
     rev = None
 
     if args.commit:
-        rev = rev_parse(args.commit)
+        rev = repo.rev_parse(args.commit)
         if not rev:
             _err('regit: invalid commit reference "%s"' % args.commit)
 
@@ -978,8 +2073,8 @@ def set_pr(args):
     except TypeError:
         _err("regit: please specify PR number as \"#12345\" or just \"12345\"!")
 
-    Branch.get()
-    b = Branch.current
+    repo.load_branches()
+    b = repo.current
     b.get_data()
     b.pr = "#%s" % pr
     b.update_branch_file()
@@ -987,157 +2082,335 @@ def set_pr(args):
     print("regit: set PR# of branch %s to %s." % (b, b.pr))
 
 
-def main():
-    os.environ["REGIT"] = "1"
-
-    try:
-        global topdir
-        topdir = git_command_output(["rev-parse", "--show-toplevel"]).rstrip()
-    except subprocess.CalledProcessError:
-        _err("regit: git error (cannot find repository root). Exiting.")
-
-    os.makedirs(os.path.join(topdir, ".git", "regit", "branches"), exist_ok=True)
-
-    parser = argparse.ArgumentParser(prog="git dep")
-
-    group = parser.add_argument_group(
-        "handling running operations",
-        "These options are only valid if a current operation is in progress, e.g., a manual conflict resolve.",
-    )
-    group.add_argument(
-        "--continue",
-        "-c",
-        action="store_true",
-        help="continue with currently running operation",
-        dest="cont",
-    )
-
-    group.add_argument(
-        "--abort", "-a", action="store_true", help="abort currently running operation"
-    )
-
-    parser.set_defaults(func=None)
-    subparsers = parser.add_subparsers(dest="cmd")
-    parser_update = subparsers.add_parser("update", help="update branch(es)")
-    parser_update.add_argument(
+def add_update_args(p):
+    p.add_argument(
         "--all",
         "-a",
         help="update all branches (default: only current)",
         action="store_true",
     )
-    parser_update.add_argument(
+    p.add_argument(
         "--recursive",
         "-r",
         help="recurse to dependency branches (default: only current)",
         action="store_true",
     )
-    parser_update.set_defaults(func=update)
+    p.add_argument(
+        "--from",
+        help="update all branches that (transitively) depend on BRANCH",
+        dest="source",
+        metavar="BRANCH",
+        default=None,
+    )
+    p.add_argument(
+        "--jobs",
+        "-j",
+        help="with --all or --from, update up to N independent branches at once, "
+        "each in its own worktree (default: 1)",
+        type=int,
+        default=1,
+        metavar="N",
+    )
+    p.set_defaults(func=update)
+
 
-    parser_init = subparsers.add_parser("init", help="initialize branch dependencies")
-    parser_init.add_argument(
+def add_init_args(p):
+    p.add_argument(
         "--base", "-b", help="base branch (default: master)", default="master"
     )
-    parser_init.add_argument(
+    p.add_argument(
         "--depends-on", "-d", help="branch dependencies (default: none)", nargs="*"
     )
-    parser_init.set_defaults(func=init)
+    p.set_defaults(func=init)
 
-    parser_add = subparsers.add_parser("add", help="add branch dependencies")
-    parser_add.add_argument("dep", nargs="+")
-    parser_add.set_defaults(func=add)
 
-    parser_del = subparsers.add_parser("del", help="del branch dependencies")
-    parser_del.add_argument("dep", nargs="+")
-    parser_del.set_defaults(func=ddel)
+def add_add_args(p):
+    p.add_argument("dep", nargs="+")
+    p.set_defaults(func=add)
 
-    parser_set = subparsers.add_parser("set", help="set branch dependencies")
-    parser_set.add_argument("dep", nargs="+")
-    parser_set.set_defaults(func=dset)
 
-    parser_show = subparsers.add_parser("show", help="show branch information")
-    parser_show.set_defaults(func=show)
+def add_del_args(p):
+    p.add_argument("dep", nargs="+")
+    p.set_defaults(func=ddel)
 
-    parser_status = subparsers.add_parser(
-        "status", help="show branch dependency status"
-    )
-    parser_status.add_argument(
+
+def add_set_args(p):
+    p.add_argument("dep", nargs="+")
+    p.set_defaults(func=dset)
+
+
+def add_show_args(p):
+    p.set_defaults(func=show)
+
+
+def add_status_args(p):
+    from regit import render
+
+    p.add_argument(
         "--all",
         "-a",
         help="show status of all branches (default: only current)",
         action="store_true",
     )
-    parser_status.add_argument(
+    p.add_argument(
         "--recursive-deps",
         "-r",
         help="show dependencies of dependencies (default: only show direct deps)",
         action="store_true",
     )
-    parser_status.add_argument(
+    # only one way of output
+    output = p.add_mutually_exclusive_group()
+    output.add_argument(
         "--dot",
         "-d",
         help="output dependencies in graphviz' dot format  (default: print human readable)",
         action="store_true",
     )
-    parser_status.add_argument(
-        "--show", "-s", help="show graph in pdf viewer", action="store_true"
+    output.add_argument(
+        "--format",
+        "-f",
+        help="output the dependency graph in this format",
+        choices=render.formats,
+        default=None,
+    )
+    p.add_argument(
+        "--show",
+        "-s",
+        help="show graph in a browser (default format: html)",
+        action="store_true",
+    )
+    output.add_argument(
+        "--json",
+        help="output a JSON list with one record per branch",
+        action="store_true",
+    )
+    output.add_argument(
+        "--ndjson",
+        help="output one JSON record per line and branch, as soon as it is known",
+        action="store_true",
     )
-    parser_status.add_argument(
+    p.add_argument(
         "--verbose",
         "-v",
         help="also print dependency and base branch status",
         action="store_true",
     )
-    parser_status.set_defaults(func=status)
+    p.add_argument(
+        "--jobs",
+        "-j",
+        help="run up to N git queries at once (default: one per CPU)",
+        type=int,
+        default=None,
+        metavar="N",
+    )
+    p.set_defaults(func=status)
+
+
+def add_dependents_args(p):
+    p.add_argument("branch", nargs="?", help="branch (default: current)", default=None)
+    p.add_argument(
+        "--recursive",
+        "-r",
+        help="also list indirect dependents, in update order",
+        action="store_true",
+    )
+    p.set_defaults(func=dependents)
+
+
+def add_cache_args(p):
+    p.add_argument("action", choices=["clear", "stats"])
+    p.set_defaults(func=cache)
+
+
+def add_migrate_args(p):
+    p.add_argument(
+        "--to",
+        choices=["file", "dir", "ref"],
+        default="file",
+        help="file: one .git/regit/branches.json (default), dir: one file per "
+        "branch, ref: in git, as refs/regit/meta",
+    )
+    p.set_defaults(func=migrate)
 
-    parser_export = subparsers.add_parser("export", help="cleanly export a branch")
-    parser_export.add_argument(
+
+def add_daemon_args(p):
+    p.add_argument("--stop", help="stop the running daemon", action="store_true")
+    p.add_argument(
+        "--poll",
+        help="check for changes by comparing mtimes instead of using inotify",
+        action="store_true",
+    )
+    p.set_defaults(func=daemon)
+
+
+def add_workspace_args(p):
+    p.add_argument("action", choices=["status", "update"])
+    p.add_argument("repos", nargs="*", help="repository paths or globs", metavar="REPO")
+    p.add_argument(
+        "--manifest",
+        "-m",
+        help="read repository paths or globs from FILE, one per line",
+        default=None,
+        metavar="FILE",
+    )
+    p.add_argument(
+        "--jobs",
+        "-j",
+        help="work on up to N repositories at once (default: one per CPU)",
+        type=int,
+        default=None,
+        metavar="N",
+    )
+    p.add_argument(
+        "--json",
+        help="output a JSON list with one record per repository",
+        action="store_true",
+    )
+    p.set_defaults(func=workspace)
+
+
+def add_export_args(p):
+    p.add_argument(
         "--name",
         "-n",
         help="name of new branch. (default: regit/export/<branch>)",
         default=None,
     )
-    parser_export.set_defaults(func=export)
+    p.set_defaults(func=export)
 
-    parser_delete_branch = subparsers.add_parser(
-        "delete-branch", help="delete a branch, updating dependencies"
-    )
-    parser_delete_branch.add_argument(
+
+def add_delete_branch_args(p):
+    p.add_argument(
         "branch", nargs="+", help="name of new branch to delete.", default=None
     )
-    parser_delete_branch.set_defaults(func=delete_branch)
+    p.set_defaults(func=delete_branch)
 
-    parser_set_rebase_tip = subparsers.add_parser(
-        "set-rebase-tip", help="update the branches rebase tip"
-    )
-    parser_set_rebase_tip.add_argument(
+
+def add_set_rebase_tip_args(p):
+    p.add_argument(
         "commit",
         nargs="?",
         help="git commit reference to use as new rebase tip",
         default=None,
     )
-    parser_set_rebase_tip.add_argument(
-        "--base", "-b", help="use head of base branch", action="store_true"
-    )
-    parser_set_rebase_tip.set_defaults(func=set_rebase_tip)
+    p.add_argument("--base", "-b", help="use head of base branch", action="store_true")
+    p.set_defaults(func=set_rebase_tip)
 
-    #
-    parser_set_pr = subparsers.add_parser(
-        "set-pr", help="update the branches rebase tip"
-    )
-    parser_set_pr.add_argument(
+
+def add_set_pr_args(p):
+    p.add_argument(
         "pr",
         nargs=1,
         help="pull request: [#]<12345>",
     )
-    parser_set_pr.set_defaults(func=set_pr)
+    p.set_defaults(func=set_pr)
+
+
+# (name, help, function setting up the arguments), in "--help" order
+subcommands = (
+    ("update", "update branch(es)", add_update_args),
+    ("init", "initialize branch dependencies", add_init_args),
+    ("add", "add branch dependencies", add_add_args),
+    ("del", "del branch dependencies", add_del_args),
+    ("set", "set branch dependencies", add_set_args),
+    ("show", "show branch information", add_show_args),
+    ("status", "show branch dependency status", add_status_args),
+    (
+        "dependents",
+        "list branches that are based on or depend on a branch",
+        add_dependents_args,
+    ),
+    ("cache", "manage the status cache", add_cache_args),
+    ("migrate", "change how branch records are stored", add_migrate_args),
+    ("daemon", "answer status queries from memory until stopped", add_daemon_args),
+    (
+        "workspace",
+        "run status or update --all in many repositories",
+        add_workspace_args,
+    ),
+    ("export", "cleanly export a branch", add_export_args),
+    (
+        "delete-branch",
+        "delete a branch, updating dependencies",
+        add_delete_branch_args,
+    ),
+    ("set-rebase-tip", "update the branches rebase tip", add_set_rebase_tip_args),
+    ("set-pr", "update the branches rebase tip", add_set_pr_args),
+)
+
+
+def make_parser(cmd=None):
+    # with a known <cmd>, only its subparser is set up. Building all of them
+    # takes longer than e.g. "show" itself.
+    parser = argparse.ArgumentParser(prog="git dep")
 
-    #    parser_add = subparsers.add_parser("filter", help="regit commit filter")
-    #    parser_add.add_argument("filter", choices = [')
-    #    parser_add.set_defaults(func=add)
+    group = parser.add_argument_group(
+        "handling running operations",
+        "These options are only valid if a current operation is in progress, e.g., a manual conflict resolve.",
+    )
+    group.add_argument(
+        "--continue",
+        "-c",
+        action="store_true",
+        help="continue with currently running operation",
+        dest="cont",
+    )
+
+    group.add_argument(
+        "--abort", "-a", action="store_true", help="abort currently running operation"
+    )
+
+    parser.set_defaults(func=None)
+    subparsers = parser.add_subparsers(dest="cmd")
+
+    known = cmd in (name for name, _, _ in subcommands)
+    for name, help, add_args in subcommands:
+        if known and name != cmd:
+            continue
+        add_args(subparsers.add_parser(name, help=help))
+
+    return parser
+
+
+def parse_args(argv):
+    # the top level options take no values, so the first other argument is
+    # the subcommand
+    cmd = next((x for x in argv if not x.startswith("-")), None)
+    parser = make_parser(cmd)
+    return parser, parser.parse_args(argv)
 
-    args = parser.parse_args()
 
-    if os.path.isfile(state_file()):
+def main():
+    os.environ["REGIT"] = "1"
+
+    argv = sys.argv[1:]
+    parser, args = parse_args(argv)
+    if args.cmd == "workspace":
+        # works on other repositories, needs none itself
+        args.func(args)
+        return
+
+    global repo
+    repo = Repository.find()
+    if not repo:
+        _err("regit: git error (cannot find repository root). Exiting.")
+    atexit.register(repo.close)
+
+    if (
+        args.cmd in daemon_commands
+        and os.path.exists(repo.daemon_socket())
+        and not os.path.isfile(repo.state_file())
+        and not os.environ.get("REGIT_NO_DAEMON")
+    ):
+        from regit import daemon
+
+        reply = daemon.query(repo.daemon_socket(), argv)
+        if reply is not None:
+            sys.stdout.write(reply["stdout"])
+            sys.stderr.write(reply["stderr"])
+            sys.exit(reply["status"])
+
+    if os.path.isfile(repo.state_file()):
         if not (args.cont or args.abort):
             _err("regit: operation in progress but no state command given.")
         else:
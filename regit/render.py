@@ -0,0 +1,160 @@
+import json
+
+# Renders the branch dependency graph without external tools. All renderers
+# take a collection of (source, target, kind) edges, where source and target
+# are node labels and kind is either "base" or "dep".
+
+formats = ["dot", "mermaid", "json", "svg", "html"]
+
+box_height = 28
+layer_height = 80
+char_width = 7.5
+padding = 12
+gap = 24
+
+
+def nodes_of(edges):
+    nodes = set()
+    for source, target, kind in edges:
+        nodes.add(source)
+        nodes.add(target)
+    return sorted(nodes)
+
+
+def adjacency(edges):
+    res = {node: [] for node in nodes_of(edges)}
+    for source, target, kind in sorted(edges):
+        res[source].append(target)
+    return res
+
+
+def dot(edges):
+    out = ['digraph "regit branch dependencies" {']
+    for source, target, kind in sorted(edges):
+        out.append('"%s" -> "%s"' % (source, target))
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+
+def mermaid(edges):
+    ids = {node: "n%s" % n for n, node in enumerate(nodes_of(edges))}
+    out = ["graph TD"]
+    for node, id in ids.items():
+        out.append('    %s["%s"]' % (id, node.replace('"', "#quot;")))
+    for source, target, kind in sorted(edges):
+        arrow = "-.->" if kind == "base" else "-->"
+        out.append("    %s %s %s" % (ids[source], arrow, ids[target]))
+    return "\n".join(out) + "\n"
+
+
+def adjacency_json(edges):
+    return json.dumps(adjacency(edges), indent=2, sort_keys=True) + "\n"
+
+
+def layout(edges):
+    # simple layered layout: every node is placed one layer above the
+    # highest of the nodes it points to, so bases end up at the bottom.
+    # returns {node: (x, y, width)} and the total width and height.
+    targets = adjacency(edges)
+    depth = {}
+    visiting = set()
+    for node in targets:
+        if node in depth:
+            continue
+        stack = [(node, iter(targets[node]))]
+        visiting.add(node)
+        while stack:
+            current, todo = stack[-1]
+            for target in todo:
+                if target not in depth and target not in visiting:
+                    visiting.add(target)
+                    stack.append((target, iter(targets[target])))
+                    break
+            else:
+                stack.pop()
+                visiting.remove(current)
+                depth[current] = 1 + max(
+                    [depth.get(x, -1) for x in targets[current]] or [-1]
+                )
+
+    layers = {}
+    for node in sorted(depth):
+        layers.setdefault(depth[node], []).append(node)
+
+    top = max(layers) if layers else 0
+    positions = {}
+    width = 0
+    for d, nodes in layers.items():
+        x = gap
+        y = gap + (top - d) * layer_height
+        for node in nodes:
+            w = len(node) * char_width + 2 * padding
+            positions[node] = (x, y, w)
+            x += w + gap
+        width = max(width, x)
+
+    height = 2 * gap + top * layer_height + box_height
+    return positions, width, height
+
+
+def escape(text):
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+    )
+
+
+def svg(edges):
+    positions, width, height = layout(edges)
+    out = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+        'font-family="monospace" font-size="12">' % (width, height),
+        "<defs><marker id=\"arrow\" viewBox=\"0 0 10 10\" refX=\"10\" refY=\"5\" "
+        'markerWidth="8" markerHeight="8" orient="auto-start-reverse">'
+        '<path d="M 0 0 L 10 5 L 0 10 z"/></marker></defs>',
+    ]
+
+    for source, target, kind in sorted(edges):
+        sx, sy, sw = positions[source]
+        tx, ty, tw = positions[target]
+        dash = ' stroke-dasharray="4 3"' if kind == "base" else ""
+        out.append(
+            '<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="black"%s '
+            'marker-end="url(#arrow)"/>'
+            % (sx + sw / 2, sy + box_height, tx + tw / 2, ty, dash)
+        )
+
+    for node, (x, y, w) in sorted(positions.items()):
+        out.append(
+            '<rect x="%.1f" y="%.1f" width="%.1f" height="%d" rx="4" '
+            'fill="white" stroke="black"/>' % (x, y, w, box_height)
+        )
+        out.append(
+            '<text x="%.1f" y="%.1f" text-anchor="middle" '
+            'dominant-baseline="central">%s</text>'
+            % (x + w / 2, y + box_height / 2, escape(node))
+        )
+
+    out.append("</svg>")
+    return "\n".join(out) + "\n"
+
+
+def html(edges):
+    return (
+        "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+        "<title>regit branch dependencies</title></head><body>\n"
+        + svg(edges)
+        + "</body></html>\n"
+    )
+
+
+def render(edges, format):
+    return {
+        "dot": dot,
+        "mermaid": mermaid,
+        "json": adjacency_json,
+        "svg": svg,
+        "html": html,
+    }[format](edges)
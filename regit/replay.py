@@ -0,0 +1,167 @@
+import os
+import re
+import subprocess
+import tempfile
+
+# Worktree-free building blocks for "git dep update": dependency merges are
+# done with "git merge-tree --write-tree" + "git commit-tree", branch commits
+# are replayed onto the new base one by one. Nothing here touches HEAD, the
+# index or the worktree. Anything that would need a human (or that the
+# installed git cannot do) raises Conflict, callers then fall back to the
+# regular checkout based path. All functions take the git.Git of the
+# repository to work on.
+
+re_author = re.compile(r"author (?P<name>.*) <(?P<email>.*)> (?P<date>\d+ [+-]\d{4})")
+
+class Conflict(Exception):
+    pass
+
+
+def tree_of(git, commit):
+    return git.rev_parse("%s^{tree}" % commit)
+
+
+def read_commit(git, commit):
+    raw = git.output(["cat-file", "commit", commit])
+    headers, _, message = raw.partition("\n\n")
+    author = None
+    for line in headers.splitlines():
+        m = re_author.match(line)
+        if m:
+            author = {
+                "GIT_AUTHOR_NAME": m.group("name"),
+                "GIT_AUTHOR_EMAIL": m.group("email"),
+                "GIT_AUTHOR_DATE": "@%s" % m.group("date"),
+            }
+            break
+
+    return author, message
+
+
+def commit_tree(git, tree, parents, message, author=None):
+    cmd = ["commit-tree", tree]
+    for parent in parents:
+        cmd.extend(["-p", parent])
+    cmd.extend(["-F", "-"])
+
+    env = None
+    if author:
+        env = dict(os.environ)
+        env.update(author)
+
+    return git.output(cmd, input=message, env=env).rstrip()
+
+
+def apply_tree(git, commit, parent, onto):
+    # fallback for git < 2.40 (no "merge-tree --merge-base"): apply the
+    # commit's patch to a throw-away index. No "--3way", that would write
+    # conflicted files into the worktree.
+    fd, index = tempfile.mkstemp(prefix="regit-index-")
+    os.close(fd)
+    os.unlink(index)
+    env = dict(os.environ, GIT_INDEX_FILE=index)
+    try:
+        git.output(["read-tree", onto], env=env)
+        diff = subprocess.Popen(
+            ["git", "diff-tree", "-p", "--binary", "--full-index", parent, commit],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=git.path,
+        )
+        res = subprocess.call(
+            ["git", "apply", "--cached"],
+            stdin=diff.stdout,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            env=env,
+            cwd=git.path,
+        )
+        diff.stdout.close()
+        diff.wait()
+        if res != 0:
+            raise Conflict()
+
+        return git.output(["write-tree"], env=env).rstrip()
+    finally:
+        if os.path.exists(index):
+            os.unlink(index)
+
+
+def pick_tree(git, commit, parent, onto):
+    if git.merge_base_option:
+        try:
+            out = git.output(
+                ["merge-tree", "--write-tree", "--merge-base=%s" % parent, onto, commit]
+            )
+            return out.splitlines()[0]
+        except subprocess.CalledProcessError as e:
+            if e.returncode != 129:
+                raise Conflict()
+            git.merge_base_option = False
+
+    return apply_tree(git, commit, parent, onto)
+
+
+def merge(git, ours, theirs, message):
+    # like "git merge --no-ff -m <message> <theirs>" on <ours>. Returns <ours>
+    # if there's nothing to merge.
+    try:
+        if git.merge_base(ours, theirs) == theirs:
+            return ours
+
+        out = git.output(["merge-tree", "--write-tree", ours, theirs])
+        tree = out.splitlines()[0]
+        return commit_tree(git, tree, [ours, theirs], message + "\n")
+    except (subprocess.CalledProcessError, UnicodeDecodeError):
+        raise Conflict()
+
+
+def replay(git, upstream, tip, onto):
+    # like "git rebase --onto <onto> <upstream> <tip>", returns the new tip
+    try:
+        out = git.output(["rev-list", "--reverse", "--parents", "%s..%s" % (upstream, tip)])
+
+        new = onto
+        for line in out.splitlines():
+            commit = line.split()
+            if len(commit) != 2:
+                # merge commits need the real rebase
+                raise Conflict()
+            commit, parent = commit
+
+            if parent == new:
+                # nothing below this commit changed, keep it
+                new = commit
+                continue
+
+            if tree_of(git, commit) == tree_of(git, parent):
+                # commits that start empty are kept
+                tree = tree_of(git, new)
+            else:
+                tree = pick_tree(git, commit, parent, new)
+                if tree == tree_of(git, new):
+                    # commits that become empty are dropped
+                    continue
+
+            author, message = read_commit(git, commit)
+            new = commit_tree(git, tree, [new], message, author)
+
+        return new
+    except (subprocess.CalledProcessError, UnicodeDecodeError):
+        raise Conflict()
+
+
+def update_branch(git, base, merges, upstream, tip):
+    # merges the (commit, message) pairs of <merges> into <base>, then replays
+    # <upstream>..<tip> onto the result. Returns (merged, new tip), new tip
+    # being None if only the replay conflicted (so the merge can be reused).
+    # Raises Conflict if a merge did. Only writes objects, never refs, so it
+    # is safe to run for several branches at once.
+    merged = base
+    for commit, message in merges:
+        merged = merge(git, merged, commit, message)
+
+    try:
+        return merged, replay(git, upstream, tip, merged)
+    except Conflict:
+        return merged, None
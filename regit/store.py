@@ -0,0 +1,326 @@
+import fcntl
+import json
+import os
+import subprocess
+
+# Storage of the branch dependency records ({"base": ..., "deps": [...], ...}).
+#
+# DirStore is the original layout, one JSON file per branch in
+# .git/regit/branches/ ("/" in branch names mangled to "__"). FileStore keeps
+# all records in a single versioned file, .git/regit/branches.json, so the
+# whole graph is loaded with one read. The repository uses FileStore once
+# that file exists ("git dep migrate" creates it).
+#
+# RefStore keeps the records in git itself: refs/regit/meta points to a
+# commit whose tree has one JSON blob per branch (names quoted, as tree
+# entries cannot contain "/"). It is pushed and fetched like any other ref,
+# every change is a commit, so "git log -p refs/regit/meta" shows the history
+# of the graph. It is used whenever that ref exists.
+#
+# DirStore and FileStore only ever replace files by renaming a completely
+# written temporary file, so a crash leaves either the old or the new record
+# behind.
+
+VERSION = 1
+REF = "refs/regit/meta"
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "%s.tmp.%s" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_json(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class DirStore(object):
+    def __init__(self, path):
+        self.path = path
+
+    def filename(self, name):
+        return os.path.join(self.path, name.replace("/", "__"))
+
+    def has(self, name):
+        return os.path.isfile(self.filename(name))
+
+    def read(self, name):
+        return read_json(self.filename(name))
+
+    def read_all(self, names=None):
+        # {name: record} for those of <names> (default: all) that have a record
+        try:
+            present = set(os.listdir(self.path))
+        except FileNotFoundError:
+            return {}
+
+        if names is None:
+            names = [
+                filename.replace("__", "/")
+                for filename in sorted(present)
+                if ".tmp." not in filename
+            ]
+
+        res = {}
+        for name in names:
+            if os.path.basename(self.filename(name)) in present:
+                record = self.read(name)
+                if record is not None:
+                    res[name] = record
+        return res
+
+    def write(self, name, record):
+        write_json(self.filename(name), record)
+
+    def write_all(self, records):
+        for name, record in records.items():
+            self.write(name, record)
+
+    def delete(self, name):
+        try:
+            os.unlink(self.filename(name))
+        except FileNotFoundError:
+            pass
+
+    def remove(self, names):
+        # drop the records of <names>, and the directory if that was all
+        for name in names:
+            self.delete(name)
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+
+class FileStore(object):
+    def __init__(self, path):
+        # reads right away, so that an unsupported version shows up here
+        self.path = path
+        self.records = None
+        self.load()
+
+    def load(self):
+        data = read_json(self.path)
+        if data is None:
+            self.records = {}
+        elif data.get("version") != VERSION:
+            raise ValueError("%s: unsupported version %s" % (self.path, data.get("version")))
+        else:
+            self.records = data["branches"]
+        return self.records
+
+    def get_records(self):
+        if self.records is None:
+            self.load()
+        return self.records
+
+    def has(self, name):
+        return name in self.get_records()
+
+    def read(self, name):
+        return self.get_records().get(name)
+
+    def read_all(self, names=None):
+        records = self.get_records()
+        if names is None:
+            return dict(records)
+        return {name: records[name] for name in names if name in records}
+
+    def modify(self, change):
+        # other processes (e.g., "git dep update -j") might have written
+        # since we loaded, so re-read under the lock before changing anything
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            records = self.load()
+            change(records)
+            write_json(self.path, {"version": VERSION, "branches": records})
+
+    def write(self, name, record):
+        self.modify(lambda records: records.__setitem__(name, record))
+
+    def write_all(self, records):
+        self.modify(lambda current: current.update(records))
+
+    def delete(self, name):
+        self.modify(lambda records: records.pop(name, None))
+
+    def remove(self, names=None):
+        for path in (self.path, self.path + ".lock"):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        self.records = None
+
+
+def parse_tree(data, oid_size=20):
+    # raw tree object -> {name: object id} for the blobs in it
+    res = {}
+    pos = 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        nul = data.index(b"\0", space)
+        mode = data[pos:space]
+        name = data[space + 1 : nul].decode()
+        if mode != b"40000":
+            res[name] = data[nul + 1 : nul + 1 + oid_size].hex()
+        pos = nul + 1 + oid_size
+    return res
+
+
+def hash_blobs(git, contents):
+    # writes all <contents> as blobs with one "git hash-object" call
+    if not contents:
+        return []
+
+    import tempfile
+
+    with tempfile.TemporaryDirectory(prefix="regit-blobs-") as tmpdir:
+        paths = []
+        for n, content in enumerate(contents):
+            path = os.path.join(tmpdir, str(n))
+            with open(path, "w") as f:
+                f.write(content)
+            paths.append(path)
+
+        out = git.output(
+            ["hash-object", "-w", "--stdin-paths"], input="\n".join(paths) + "\n"
+        )
+    return out.split()
+
+
+class RefStore(object):
+    def __init__(self, git, ref=REF):
+        self.git = git
+        self.path = ref
+        self.records = None
+        self.commit = None
+        self.entries = {}
+
+    def load(self, commit=None):
+        # the tree and all blobs are read in two cat-file requests
+        import urllib.parse
+
+        self.commit = commit or self.git.commit_id(self.path)
+        self.entries = {}
+        if self.commit:
+            tree = self.git.read_object("%s^{tree}" % self.commit)
+            if tree:
+                self.entries = parse_tree(tree[2], len(self.commit) // 2)
+
+        blobs = self.git.read_objects(sorted(set(self.entries.values())))
+        self.records = {}
+        for name, blob in self.entries.items():
+            if blob in blobs:
+                self.records[urllib.parse.unquote(name)] = json.loads(blobs[blob])
+        return self.records
+
+    def get_records(self):
+        if self.records is None:
+            # open_store() may know the commit already
+            self.load(self.commit)
+        return self.records
+
+    def has(self, name):
+        return name in self.get_records()
+
+    def read(self, name):
+        return self.get_records().get(name)
+
+    def read_all(self, names=None):
+        records = self.get_records()
+        if names is None:
+            return dict(records)
+        return {name: records[name] for name in names if name in records}
+
+    def write_tree(self, records):
+        import urllib.parse
+
+        entries = {}
+        new = []
+        for name, record in records.items():
+            quoted = urllib.parse.quote(name, safe="")
+            if record == self.records.get(name) and quoted in self.entries:
+                entries[quoted] = self.entries[quoted]
+            else:
+                new.append((quoted, json.dumps(record, indent=2, sort_keys=True) + "\n"))
+
+        blobs = hash_blobs(self.git, [content for quoted, content in new])
+        for (quoted, content), blob in zip(new, blobs):
+            entries[quoted] = blob
+
+        mktree = "".join(
+            "100644 blob %s\t%s\0" % (blob, quoted)
+            for quoted, blob in sorted(entries.items())
+        )
+        return self.git.output(["mktree", "-z"], input=mktree).rstrip()
+
+    def modify(self, change):
+        # "update-ref <new> <old>" only succeeds if nobody else moved the ref
+        # in between, otherwise start over from what they wrote
+        for attempt in range(10):
+            try:
+                old = self.git.output(["rev-parse", "-q", "--verify", self.path]).rstrip()
+            except subprocess.CalledProcessError:
+                old = ""
+            self.load(old or None)
+
+            records = dict(self.records)
+            change(records)
+            if records == self.records and old:
+                return
+
+            cmd = ["commit-tree", self.write_tree(records), "-m", "regit: update branch records"]
+            if old:
+                cmd.extend(["-p", old])
+            new = self.git.output(cmd).rstrip()
+
+            try:
+                self.git.output(["update-ref", "-m", "regit", self.path, new, old])
+            except subprocess.CalledProcessError:
+                continue
+
+            self.load(new)
+            return
+
+        raise RuntimeError("%s: too many concurrent updates" % self.path)
+
+    def write(self, name, record):
+        self.modify(lambda records: records.__setitem__(name, record))
+
+    def write_all(self, records):
+        self.modify(lambda current: current.update(records))
+
+    def delete(self, name):
+        self.modify(lambda records: records.pop(name, None))
+
+    def remove(self, names=None):
+        try:
+            self.git.output(["update-ref", "-d", self.path])
+        except subprocess.CalledProcessError:
+            pass
+        self.records = None
+        self.commit = None
+
+
+def open_store(git, dirpath, filepath, meta=None):
+    # <meta> is what REF points to, if already known ("" if it doesn't exist)
+    if meta is None:
+        meta = git.commit_id(REF)
+    if meta:
+        res = RefStore(git)
+        res.commit = meta
+        return res
+    if os.path.isfile(filepath):
+        return FileStore(filepath)
+    return DirStore(dirpath)
@@ -0,0 +1,102 @@
+import glob
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from regit import git
+from regit.parallel import child_env
+
+# Runs "git dep status" or "git dep update" in many repositories at once.
+# Every repository gets its own regit process, so a conflict (or crash) in
+# one of them only fails that one; an update stopped for conflict resolution
+# is continued there with "git dep --continue" as usual.
+#
+# A manifest lists one repository path or glob per line, relative to the
+# manifest's directory. Empty lines and lines starting with "#" are skipped.
+
+
+def read_manifest(path):
+    res = []
+    topdir = os.path.dirname(os.path.abspath(path))
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            res.append(os.path.join(topdir, line))
+    return res
+
+
+def is_repository(path):
+    # true if <path> is the top directory of a repository's worktree (and
+    # not just somewhere inside one)
+    found = git.find_repository(path)
+    if found:
+        top = found[0]
+    else:
+        try:
+            top = git.Git(path).output(["rev-parse", "--show-toplevel"]).rstrip()
+        except (subprocess.CalledProcessError, OSError):
+            return False
+    return os.path.realpath(top) == os.path.realpath(path)
+
+
+def find_repositories(patterns):
+    # the repositories matched by <patterns>, in the given order and without
+    # duplicates. Glob matches that are not repositories are skipped, plain
+    # paths are returned as they are, to be reported as failed if need be.
+    res = []
+    seen = set()
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths = []
+            for path in sorted(glob.glob(pattern)):
+                if not os.path.isdir(path):
+                    continue
+                if not is_repository(path):
+                    print(
+                        "regit: skipping %s, not a repository." % path, file=sys.stderr
+                    )
+                    continue
+                paths.append(path)
+        else:
+            paths = [pattern]
+
+        for path in paths:
+            path = os.path.abspath(path)
+            if path not in seen:
+                seen.add(path)
+                res.append(path)
+    return res
+
+
+def run_in(path, cmd):
+    # (returncode, output, seconds) of "git dep <cmd>" in <path>
+    start = time.monotonic()
+    if not os.path.isdir(path):
+        return (1, "regit: %s: no such directory\n" % path, 0.0)
+    if not is_repository(path):
+        return (1, "regit: %s: not a repository\n" % path, 0.0)
+
+    proc = subprocess.run(
+        [sys.executable, "-m", "regit"] + cmd,
+        cwd=path,
+        env=child_env(),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    return (proc.returncode, proc.stdout, time.monotonic() - start)
+
+
+def run_all(paths, cmd, jobs):
+    # returns [(path, returncode, output, seconds)], in the order of <paths>
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_in, path, cmd) for path in paths]
+        res = []
+        for path, future in zip(paths, futures):
+            res.append((path,) + future.result())
+
+    return res
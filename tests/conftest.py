@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+topdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, topdir)
+
+
+def git(path, *args, input=None):
+    return subprocess.check_output(
+        ["git", "-C", str(path)] + list(args),
+        input=input,
+        universal_newlines=True,
+        stderr=subprocess.DEVNULL,
+    ).rstrip("\n")
+
+
+def regit(path, *args):
+    # "git dep <args>" in <path>, as its own process
+    env = dict(os.environ, PYTHONPATH=topdir)
+    return subprocess.run(
+        [sys.executable, "-m", "regit"] + list(args),
+        cwd=str(path),
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+def commit(path, name, content=None):
+    with open(os.path.join(str(path), name), "w") as f:
+        f.write(content if content is not None else name + "\n")
+    git(path, "add", name)
+    git(path, "commit", "-q", "-m", name)
+    return git(path, "rev-parse", "HEAD")
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    # no user or system git config, no daemon
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    monkeypatch.setenv("REGIT_NO_DAEMON", "1")
+    for var in ("GIT_DIR", "GIT_WORK_TREE", "GIT_CEILING_DIRECTORIES"):
+        monkeypatch.delenv(var, raising=False)
+    for who in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv("GIT_%s_NAME" % who, "regit")
+        monkeypatch.setenv("GIT_%s_EMAIL" % who, "regit@example.com")
+
+
+@pytest.fixture
+def repo(tmp_path):
+    # master, core_fix (on master), driver (on master, needs core_fix) and
+    # app (on master, needs driver and core_fix), app checked out
+    path = tmp_path / "repo"
+    path.mkdir()
+    git(path, "init", "-q", "-b", "master")
+    commit(path, "a")
+
+    for name, deps in (
+        ("core_fix", []),
+        ("driver", ["core_fix"]),
+        ("app", ["driver", "core_fix"]),
+    ):
+        git(path, "checkout", "-q", "-b", name, "master")
+        commit(path, name)
+        res = regit(path, "init", "-b", "master", *(["-d"] + deps if deps else []))
+        assert res.returncode == 0, res.stderr
+
+    return path
@@ -0,0 +1,47 @@
+import pytest
+
+from regit import regit
+
+
+def subparsers(parser):
+    return parser._subparsers._group_actions[0].choices
+
+
+def test_only_the_given_subcommand_is_set_up():
+    parser, args = regit.parse_args(["-c", "status", "--all", "-j", "2"])
+    assert list(subparsers(parser)) == ["status"]
+    assert (args.cmd, args.cont, args.all, args.jobs) == ("status", True, True, 2)
+    assert args.func is regit.status
+
+
+def test_full_tree():
+    names = [name for name, _, _ in regit.subcommands]
+    assert list(subparsers(regit.make_parser())) == names
+    assert list(subparsers(regit.make_parser("bogus"))) == names
+
+    parser, args = regit.parse_args([])
+    assert args.func is None
+    with pytest.raises(SystemExit):
+        regit.parse_args(["bogus"])
+
+
+def test_reused_parser():
+    # as the daemon does it
+    parser = regit.make_parser()
+    assert parser.parse_args(["dependents", "-r", "x"]).branch == "x"
+    args = parser.parse_args(["dependents"])
+    assert (args.branch, args.recursive) == (None, False)
+
+
+@pytest.mark.parametrize(
+    "flags", [["--json", "--dot"], ["--json", "--ndjson"], ["--ndjson", "-f", "svg"]]
+)
+def test_status_outputs_exclude_each_other(flags, capsys):
+    with pytest.raises(SystemExit):
+        regit.parse_args(["status"] + flags)
+    assert "not allowed with argument" in capsys.readouterr().err
+
+
+def test_status_show_takes_a_format():
+    parser, args = regit.parse_args(["status", "--show", "-f", "svg"])
+    assert (args.show, args.format) == (True, "svg")
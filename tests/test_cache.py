@@ -0,0 +1,126 @@
+import json
+import multiprocessing
+import os
+
+from regit.cache import StatusCache
+from regit.regit import Repository
+
+from conftest import commit, git, regit
+
+
+def test_roundtrip(tmp_path):
+    path = str(tmp_path / "cache")
+    cache = StatusCache(path)
+    cache.load()
+    assert cache.get_missing("a", "b") is None
+    cache.set_missing("a", "b", True)
+    cache.set_missing("c", "d", False)
+    cache.set_stale("x", {"x": ["a", None, []]}, True)
+    cache.save()
+
+    cache = StatusCache(path)
+    cache.load()
+    assert cache.get_missing("a", "b") is True
+    assert cache.get_missing("c", "d") is False
+    assert cache.get_stale("x", {"x": ["a", None, []]}) is True
+    assert cache.get_stale("x", {"x": ["b", None, []]}) is None
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_save_drops_answers_about_old_tips(tmp_path):
+    cache = StatusCache(str(tmp_path / "cache"))
+    cache.set_missing("a", "b", True)
+    cache.set_missing("a", "c", True)
+    cache.save(["a", "b"])
+    assert list(cache.missing) == ["a b"]
+
+
+def test_lookups_alone_do_not_save(tmp_path):
+    path = str(tmp_path / "cache")
+    cache = StatusCache(path)
+    cache.get_missing("a", "b")
+    cache.save()
+    assert not os.path.exists(path)
+
+    cache.set_missing("a", "b", True)
+    cache.save()
+    cache = StatusCache(path)
+    cache.load()
+    assert cache.get_missing("a", "b") is True
+    assert not cache.dirty
+
+
+def save_often(path, i):
+    for n in range(20):
+        cache = StatusCache(path)
+        cache.set_missing(str(i), str(n), True)
+        cache.save()
+
+
+def test_concurrent_saves(tmp_path):
+    # e.g., a shell prompt and an editor running "status" at the same time
+    path = str(tmp_path / "cache")
+    procs = [
+        multiprocessing.Process(target=save_often, args=(path, i)) for i in range(8)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert [p.exitcode for p in procs] == [0] * 8
+    assert os.listdir(str(tmp_path)) == ["cache"]
+
+
+def test_other_versions_are_ignored(tmp_path):
+    path = tmp_path / "cache"
+    path.write_text(json.dumps({"version": 0, "missing": {"a b": True}}))
+    cache = StatusCache(str(path))
+    cache.load()
+    assert cache.missing == {}
+
+
+def closure_key(path, name):
+    r = Repository.find(str(path))
+    r.load_branches(True)
+    res = r.get_graph().closure_key(r.map[name])
+    r.close()
+    return res
+
+
+def test_key_changes_with_edges(repo):
+    # same tips, different graph: the cached answer must not be served
+    before = closure_key(repo, "app")
+    assert regit(repo, "del", "core_fix").returncode == 0
+    after = closure_key(repo, "app")
+    assert set(before) == set(after)
+    assert before != after
+
+    cache = StatusCache(str(repo / "cache"))
+    cache.set_stale("app", before, False)
+    assert cache.get_stale("app", after) is None
+
+
+def test_key_changes_with_tips(repo):
+    before = closure_key(repo, "app")
+    git(repo, "checkout", "-q", "core_fix")
+    commit(repo, "more")
+    assert closure_key(repo, "app") != before
+    assert set(closure_key(repo, "core_fix")) == {"core_fix", "master"}
+
+
+def test_status_uses_and_updates_cache(repo):
+    assert regit(repo, "update", "--all").returncode == 0
+    res = regit(repo, "status", "--all")
+    assert "branch app is up to date" in res.stdout
+    cache = repo / ".git" / "regit" / "status-cache"
+    mtime = cache.stat().st_mtime_ns
+    again = regit(repo, "status", "--all")
+    assert again.stdout == res.stdout
+    # all answers came from the cache, nothing to write back
+    assert cache.stat().st_mtime_ns == mtime
+
+    git(repo, "checkout", "-q", "core_fix")
+    commit(repo, "more")
+    res = regit(repo, "status", "--all")
+    assert "branch app needs update" in res.stdout
+    assert "branch driver needs update" in res.stdout
@@ -0,0 +1,113 @@
+import os
+import socket
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+from regit import daemon
+from regit.regit import Repository
+
+from conftest import commit, git, regit, topdir
+
+
+@pytest.fixture(params=["inotify", "poll"])
+def server(request, repo):
+    cmd = [sys.executable, "-m", "regit", "daemon"]
+    if request.param == "poll":
+        cmd.append("--poll")
+    proc = subprocess.Popen(
+        cmd,
+        cwd=str(repo),
+        env=dict(os.environ, PYTHONPATH=topdir),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    path = str(repo / ".git" / "regit" / "daemon.sock")
+    for _ in range(100):
+        if daemon.query(path, ["daemon", "--ping"]) is not None:
+            break
+        time.sleep(0.05)
+    else:
+        proc.kill()
+        pytest.fail("daemon did not start")
+
+    yield path
+
+    daemon.query(path, ["daemon", "--stop"])
+    proc.wait(10)
+
+
+def test_answers_and_reloads(repo, server):
+    direct = regit(repo, "status", "--all").stdout
+    reply = daemon.query(server, ["status", "--all"])
+    assert reply["status"] == 0
+    assert reply["stdout"] == direct
+
+    git(repo, "checkout", "-q", "core_fix")
+    commit(repo, "more")
+    reply = daemon.query(server, ["show"])
+    assert "Branch......: core_fix" in reply["stdout"]
+    reply = daemon.query(server, ["status", "--all"])
+    assert reply["stdout"] == regit(repo, "status", "--all").stdout
+
+    # a branch below a directory that did not exist when the daemon started
+    git(repo, "branch", "topic/new/x", "master")
+    reply = daemon.query(server, ["dependents", "master"])
+    assert reply["stdout"] == regit(repo, "dependents", "master").stdout
+
+
+def test_errors_and_fallback(repo, server):
+    reply = daemon.query(server, ["dependents", "nonexistent"])
+    assert reply["status"] != 0
+
+    # commands that write are never run by the daemon
+    assert daemon.query(server, ["update", "--all"]) is None
+    assert daemon.query(server, ["status", "--show"]) is None
+
+
+def test_stalled_client(repo, server):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stalled:
+        stalled.connect(server)
+        stalled.sendall(b'{"argv": ["show"]')
+        # no newline, ever. the daemon gives up on it and answers the next one
+        reply = daemon.query(server, ["show"])
+        assert reply is not None
+        assert reply["status"] == 0
+        assert stalled.recv(1) == b""
+
+
+def test_socket_is_private(server):
+    assert stat.S_IMODE(os.stat(server).st_mode) == 0o600
+
+
+def test_stop(repo, server):
+    assert regit(repo, "daemon", "--stop").returncode == 0
+    for _ in range(100):
+        if not os.path.exists(server):
+            break
+        time.sleep(0.05)
+    assert not os.path.exists(server)
+    assert daemon.query(server, ["show"]) is None
+
+
+def test_no_daemon(repo):
+    path = str(repo / ".git" / "regit" / "daemon.sock")
+    assert daemon.query(path, ["show"]) is None
+    assert "no daemon running" in regit(repo, "daemon", "--stop").stderr
+
+
+def test_relevant(repo):
+    r = Repository.find(str(repo))
+    regit_dir = os.path.join(r.gitdir, "regit")
+    assert daemon.relevant(r.gitdir, "HEAD", r)
+    assert daemon.relevant(r.gitdir, "packed-refs", r)
+    assert not daemon.relevant(r.gitdir, "index", r)
+    assert not daemon.relevant(r.gitdir, "HEAD.lock", r)
+    assert not daemon.relevant(regit_dir, "status-cache", r)
+    assert not daemon.relevant(regit_dir, "daemon.sock", r)
+    assert not daemon.relevant(regit_dir, "graph.html", r)
+    assert daemon.relevant(regit_dir, "branches.json", r)
+    r.close()
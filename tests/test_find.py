@@ -0,0 +1,63 @@
+import os
+
+from regit import git as regit_git
+from regit.regit import Repository, parse_args
+
+from conftest import git, regit
+
+
+def test_top_and_subdirectory(repo):
+    (repo / "sub").mkdir()
+    top = str(repo)
+    gitdir = os.path.join(top, ".git")
+    assert regit_git.find_repository(top) == (top, gitdir, gitdir)
+    assert regit_git.find_repository(str(repo / "sub")) == (top, gitdir, gitdir)
+
+
+def test_linked_worktree(repo, tmp_path):
+    path = str(tmp_path / "wt")
+    git(repo, "worktree", "add", "-q", path, "driver")
+    top, gitdir, commondir = regit_git.find_repository(path)
+    assert top == path
+    assert gitdir == os.path.join(str(repo), ".git", "worktrees", "wt")
+    assert commondir == os.path.join(str(repo), ".git")
+
+
+def test_inside_git_dir(repo):
+    # there is no worktree to work on in there
+    assert regit_git.find_repository(str(repo / ".git")) is None
+    assert regit_git.find_repository(str(repo / ".git" / "refs")) is None
+    assert Repository.find(str(repo / ".git")) is None
+
+
+def test_core_worktree(repo, tmp_path):
+    # the worktree is elsewhere, only git knows where
+    gitdir = tmp_path / "separate.git"
+    os.rename(str(repo / ".git"), str(gitdir))
+    git(tmp_path, "--git-dir", str(gitdir), "config", "core.worktree", str(repo))
+    (tmp_path / "elsewhere").mkdir()
+    (tmp_path / "elsewhere" / ".git").write_text("gitdir: %s\n" % gitdir)
+
+    assert regit_git.find_repository(str(tmp_path / "elsewhere")) is None
+    r = Repository.find(str(tmp_path / "elsewhere"))
+    assert r.topdir == str(repo)
+    r.close()
+
+
+def test_parse_args():
+    parser, args = parse_args(["-c"])
+    assert args.cont and args.cmd is None
+
+    parser, args = parse_args(["--abort", "status", "-a", "-f", "json"])
+    assert args.abort and args.cmd == "status" and args.all
+    assert args.format == "json"
+
+    parser, args = parse_args(["update", "-j", "4", "--from", "core_fix"])
+    assert args.jobs == 4 and args.source == "core_fix"
+
+
+def test_show_from_subdirectory(repo):
+    (repo / "sub").mkdir()
+    res = regit(repo / "sub", "show")
+    assert res.returncode == 0
+    assert "Branch......: app" in res.stdout
@@ -0,0 +1,94 @@
+from regit.git import Git
+from regit.regit import CommitIndex, Repository
+
+from conftest import commit, git
+
+
+def test_commit_index(repo):
+    g = Git(str(repo))
+    master = git(repo, "rev-parse", "master")
+    core_fix = git(repo, "rev-parse", "core_fix")
+    git(repo, "checkout", "-q", "master")
+    older = commit(repo, "m1")
+    newer = commit(repo, "m2")
+
+    index = CommitIndex(g, [newer, core_fix])
+    assert index.valid
+    assert index.missing(core_fix, newer) is True
+    assert index.missing(newer, core_fix) is True
+    assert index.missing(newer, newer) is False
+
+    # only the tips it was built from are answered, the ancestry of other
+    # commits may reach below what was loaded
+    assert index.missing(older, core_fix) is None
+    assert index.missing(master, newer) is None
+    g.close()
+
+
+def test_commit_index_ignores_dependency_updates(repo):
+    g = Git(str(repo))
+    base = git(repo, "rev-parse", "core_fix")
+    git(repo, "checkout", "-q", "-b", "update", "core_fix")
+    (repo / "u").write_text("u\n")
+    git(repo, "add", "u")
+    git(repo, "commit", "-q", "-m", "DEPENDENCY UPDATE")
+    update = git(repo, "rev-parse", "HEAD")
+
+    index = CommitIndex(g, [base, update])
+    assert index.missing(base, update) is False
+    g.close()
+
+
+def test_commit_index_limit(repo, monkeypatch):
+    g = Git(str(repo))
+    monkeypatch.setattr(CommitIndex, "max_commits", 0)
+    tips = [git(repo, "rev-parse", x) for x in ("core_fix", "driver")]
+    index = CommitIndex(g, tips)
+    assert not index.valid
+    assert index.missing(*tips) is None
+    g.close()
+
+
+def load(path):
+    r = Repository.find(str(path))
+    r.load_branches(True)
+    return r, r.get_graph()
+
+
+def test_reachability_index(repo):
+    r, graph = load(repo)
+    index = graph.get_index()
+    m = r.map
+
+    assert index.depends_on(m["app"], m["core_fix"])
+    assert index.depends_on(m["app"], m["master"])
+    assert index.depends_on(m["driver"], m["core_fix"])
+    assert not index.depends_on(m["core_fix"], m["driver"])
+    assert not index.depends_on(m["app"], m["app"])
+
+    assert sorted(str(x) for x in index.get_ancestors(m["app"])) == [
+        "core_fix",
+        "driver",
+        "master",
+    ]
+    assert [str(x) for x in index.get_descendants(m["core_fix"])] == ["driver", "app"]
+
+    # core_fix is reachable through driver already
+    assert [str(x) for x in index.reduced_inputs(m["app"])] == ["driver"]
+    assert [str(x) for x in m["app"].get_deps(True, False)] == ["core_fix"]
+    r.close()
+
+
+def test_layers_and_dependents(repo):
+    r, graph = load(repo)
+    assert [[str(x) for x in layer] for layer in graph.layers()] == [
+        ["core_fix"],
+        ["driver"],
+        ["app"],
+    ]
+    assert [str(x) for x in graph.dependents(r.map["core_fix"])] == ["app", "driver"]
+    assert [str(x) for x in graph.dependents(r.map["core_fix"], True)] == [
+        "driver",
+        "app",
+    ]
+    r.close()
@@ -0,0 +1,61 @@
+from regit.git import Status
+from regit.regit import Repository
+
+from conftest import commit, git
+
+
+def test_clean():
+    status = Status("")
+    assert status.clean()
+    assert status.automerge_complete()
+
+
+def test_ordinary_and_renamed():
+    out = (
+        "1 .M N... 100644 100644 100644 1111111 1111111 a file\0"
+        "2 R. N... 100644 100644 100644 2222222 2222222 R100 new name\0old name\0"
+    )
+    status = Status(out)
+    assert status.entries == [("1", ".M", "a file"), ("2", "R.", "new name")]
+    assert not status.clean()
+    # unstaged change
+    assert not status.automerge_complete()
+
+
+def test_staged_only_is_automerge_complete():
+    out = "1 M. N... 100644 100644 100644 1111111 2222222 resolved\0"
+    assert Status(out).automerge_complete()
+
+
+def test_unmerged():
+    out = "u UU N... 100644 100644 100644 100644 1111111 2222222 3333333 both\0"
+    status = Status(out)
+    assert status.entries == [("u", "UU", "both")]
+    assert not status.automerge_complete()
+
+
+def test_workdir_clean(repo):
+    r = Repository.find(str(repo))
+    assert r.workdir_clean()
+
+    (repo / "a").write_text("changed\n")
+    r.git.reset()
+    assert not r.workdir_clean()
+
+    # untracked files don't count
+    git(repo, "checkout", "-q", "a")
+    (repo / "untracked").write_text("x\n")
+    r.git.reset()
+    assert r.workdir_clean()
+    r.close()
+
+
+def test_automerge_complete_after_staging(repo):
+    r = Repository.find(str(repo))
+    commit(repo, "b")
+    (repo / "b").write_text("staged\n")
+    git(repo, "add", "b")
+    r.git.reset()
+    assert not r.workdir_clean()
+    assert r.automerge_complete()
+    r.close()
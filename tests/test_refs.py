@@ -0,0 +1,59 @@
+from regit.regit import Repository
+
+from conftest import commit, git
+
+
+def test_snapshot(repo, tmp_path):
+    git(repo, "branch", "-q", "--set-upstream-to", "master", "driver")
+    worktree = str(tmp_path / "wt")
+    git(repo, "worktree", "add", "-q", worktree, "core_fix")
+
+    r = Repository.find(str(repo))
+    current = r.load_refs()
+    assert current is r.map["app"]
+    assert sorted(r.map) == ["app", "core_fix", "driver", "master"]
+    for name in r.map:
+        assert r.map[name].tip == git(repo, "rev-parse", name)
+
+    assert r.map["driver"].upstream == "refs/heads/master"
+    assert r.map["app"].upstream is None
+    assert r.map["core_fix"].worktree == worktree
+    assert r.map["core_fix"].checked_out_elsewhere()
+    assert not r.map["app"].checked_out_elsewhere()
+    assert r.meta == ""
+    r.close()
+
+
+def test_detached_head(repo):
+    git(repo, "checkout", "-q", "--detach")
+    r = Repository.find(str(repo))
+    assert r.load_refs() is None
+    r.close()
+
+
+def test_head_reloads_after_writes(repo):
+    r = Repository.find(str(repo))
+    r.load_branches()
+    app = r.map["app"]
+    old = app.head()
+
+    new = commit(repo, "outside")
+    # not noticed until this process writes
+    assert app.head() == old
+    r.command(["update-ref", "refs/heads/scratch", new])
+    assert app.head() == new
+    assert r.map["scratch"].head() == new
+
+    # deleted branches lose their tip
+    r.command(["branch", "-q", "-D", "scratch"])
+    assert r.map["scratch"].head() is None
+    r.close()
+
+
+def test_branch_names_with_slashes(repo):
+    git(repo, "branch", "feature/x/y", "master")
+    r = Repository.find(str(repo))
+    r.load_branches()
+    assert r.map["feature/x/y"].tip == git(repo, "rev-parse", "master")
+    assert [b.name for b in r.list] == sorted(r.map)
+    r.close()
@@ -0,0 +1,59 @@
+import pytest
+
+from regit import replay
+from regit.git import Git
+
+from conftest import commit, git, regit
+
+
+@pytest.fixture(params=[True, False])
+def g(request, repo):
+    # "merge-tree --merge-base" if the installed git has it, and without
+    g = Git(str(repo))
+    g.merge_base_option = request.param
+    yield g
+    g.close()
+
+
+def test_replay(repo, g):
+    git(repo, "checkout", "-q", "master")
+    master = commit(repo, "b")
+    tip = git(repo, "rev-parse", "core_fix")
+
+    new = replay.replay(g, "core_fix~1", "core_fix", master)
+    assert git(repo, "rev-parse", new + "~1") == master
+    assert git(repo, "show", "-s", "--format=%an %s", new) == "regit core_fix"
+    assert git(repo, "diff", "--name-only", tip + "~1", tip) == "core_fix"
+    assert git(repo, "diff", "--name-only", master, new) == "core_fix"
+    # nothing changed below the commit, it is kept as is
+    parent = git(repo, "rev-parse", "core_fix~1")
+    assert replay.replay(g, parent, tip, parent) == tip
+    assert git(repo, "status", "--porcelain") == ""
+
+
+def test_conflict_leaves_worktree_alone(repo, g):
+    git(repo, "checkout", "-q", "master")
+    master = commit(repo, "core_fix", "conflicting\n")
+    git(repo, "checkout", "-q", "app")
+
+    with pytest.raises(replay.Conflict):
+        replay.replay(g, "core_fix~1", "core_fix", master)
+    assert git(repo, "status", "--porcelain") == ""
+
+    merged, tip = replay.update_branch(
+        g, master, [], "core_fix~1", git(repo, "rev-parse", "core_fix")
+    )
+    assert (merged, tip) == (master, None)
+    assert git(repo, "status", "--porcelain") == ""
+
+
+def test_conflict_falls_back_to_rebase(repo):
+    git(repo, "checkout", "-q", "master")
+    commit(repo, "core_fix", "conflicting\n")
+    git(repo, "checkout", "-q", "app")
+
+    res = regit(repo, "update", "--all")
+    assert res.returncode == 1
+    assert "cannot be updated in-memory, using the worktree" in res.stdout
+    assert "rebasing failed. manually complete rebase" in res.stderr
+    assert git(repo, "diff", "--name-only", "--diff-filter=U") == "core_fix"
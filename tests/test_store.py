@@ -0,0 +1,161 @@
+import json
+import os
+
+import pytest
+
+from regit import store
+from regit.git import Git
+from regit.regit import Repository
+
+from conftest import git, regit
+
+record = {"base": "master", "deps": [], "rebase_tip": "0" * 40}
+
+
+@pytest.mark.parametrize("kind", ["dir", "file"])
+def test_store_api(tmp_path, kind):
+    if kind == "dir":
+        s = store.DirStore(str(tmp_path / "branches"))
+    else:
+        s = store.FileStore(str(tmp_path / "branches.json"))
+
+    assert not s.has("a/b")
+    assert s.read_all() == {}
+    s.write("a/b", record)
+    s.write_all({"c": dict(record, deps=["a/b"])})
+    assert s.has("a/b")
+    assert s.read("c")["deps"] == ["a/b"]
+    assert sorted(s.read_all()) == ["a/b", "c"]
+    assert sorted(s.read_all(["c", "missing"])) == ["c"]
+
+    s.delete("a/b")
+    assert not s.has("a/b")
+    s.remove(["c"])
+    assert not os.path.exists(s.path)
+
+
+def test_file_store_rereads_before_writing(tmp_path):
+    path = str(tmp_path / "branches.json")
+    first = store.FileStore(path)
+    second = store.FileStore(path)
+    assert first.read_all() == {}
+    second.write("b", record)
+    first.write("a", record)
+    assert sorted(store.FileStore(path).read_all()) == ["a", "b"]
+
+
+def test_file_store_version(tmp_path):
+    path = tmp_path / "branches.json"
+    path.write_text(json.dumps({"version": 99, "branches": {}}))
+    with pytest.raises(ValueError):
+        store.FileStore(str(path))
+
+
+def test_unsupported_version_is_reported(repo):
+    assert regit(repo, "migrate").returncode == 0
+    path = repo / ".git" / "regit" / "branches.json"
+    path.write_text(json.dumps({"version": 99, "branches": {}}))
+    res = regit(repo, "show")
+    assert res.returncode == 1
+    assert "Traceback" not in res.stderr
+    assert "unsupported version 99" in res.stderr
+
+
+def test_open_store(repo):
+    g = Git(str(repo))
+    dirpath = str(repo / ".git" / "regit" / "branches")
+    filepath = str(repo / ".git" / "regit" / "branches.json")
+    assert isinstance(store.open_store(g, dirpath, filepath), store.DirStore)
+    assert regit(repo, "migrate").returncode == 0
+    assert isinstance(store.open_store(g, dirpath, filepath), store.FileStore)
+    g.close()
+
+
+def records(path):
+    r = Repository.find(str(path))
+    r.load_branches(True)
+    res = r.get_store().read_all()
+    r.close()
+    return res
+
+
+@pytest.mark.parametrize(
+    "order", [["file"], ["file", "dir"], ["ref"], ["file", "ref", "dir"]]
+)
+def test_migrate_keeps_records_of_missing_branches(repo, order):
+    # "app" is deleted (or not fetched yet), its record has to survive
+    git(repo, "checkout", "-q", "master")
+    git(repo, "branch", "-q", "-D", "app")
+    before = records(repo)
+    assert sorted(before) == ["app", "core_fix", "driver"]
+
+    for kind in order:
+        res = regit(repo, "migrate", "--to", kind)
+        assert res.returncode == 0, res.stderr
+        assert "moved 3 branch records" in res.stdout
+        assert records(repo) == before
+
+    regit_dir = repo / ".git" / "regit"
+    if order[-1] != "file":
+        assert not (regit_dir / "branches.json").exists()
+    if order[-1] != "dir":
+        assert not (regit_dir / "branches").exists()
+    if order[-1] != "ref":
+        assert git(repo, "for-each-ref", store.REF) == ""
+
+
+def test_ref_store(repo):
+    g = Git(str(repo))
+    s = store.RefStore(g)
+    assert s.read_all() == {}
+    s.write("a/b", record)
+    s.write_all({"c": dict(record, deps=["a/b"])})
+
+    # one commit per change, names quoted in the tree
+    assert git(repo, "rev-list", "--count", store.REF) == "2"
+    assert git(repo, "ls-tree", "--name-only", store.REF).split() == ["a%2Fb", "c"]
+    assert store.RefStore(g).read_all() == {
+        "a/b": record,
+        "c": dict(record, deps=["a/b"]),
+    }
+
+    # unchanged records keep their blob, no-op writes make no commit
+    blob = git(repo, "rev-parse", "%s:a%%2Fb" % store.REF)
+    s.write("c", record)
+    s.write("c", record)
+    assert git(repo, "rev-parse", "%s:a%%2Fb" % store.REF) == blob
+    assert git(repo, "rev-list", "--count", store.REF) == "3"
+
+    s.delete("a/b")
+    assert not store.RefStore(g).has("a/b")
+    s.remove()
+    assert git(repo, "for-each-ref", store.REF) == ""
+    g.close()
+
+
+def test_ref_store_concurrent_writers(repo):
+    g = Git(str(repo))
+    first = store.RefStore(g)
+    second = store.RefStore(g)
+    assert first.read_all() == {}
+    second.write("b", record)
+    # first's view is outdated, its update-ref fails and it starts over
+    first.write("a", record)
+    assert sorted(store.RefStore(g).read_all()) == ["a", "b"]
+    g.close()
+
+
+def test_ref_store_is_found_in_ref_snapshot(repo):
+    assert regit(repo, "migrate", "--to", "ref").returncode == 0
+    r = Repository.find(str(repo))
+    r.load_branches(True)
+    assert r.meta == git(repo, "rev-parse", store.REF)
+    s = r.get_store()
+    assert isinstance(s, store.RefStore)
+    assert s.commit == r.meta
+    assert sorted(s.read_all()) == ["app", "core_fix", "driver"]
+    r.close()
+
+    res = regit(repo, "show")
+    assert res.returncode == 0
+    assert "Dependencies: driver, core_fix" in res.stdout
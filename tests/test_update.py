@@ -0,0 +1,93 @@
+from conftest import commit, git, regit
+
+
+def worktrees(path):
+    return git(path, "worktree", "list", "--porcelain").count("worktree ")
+
+
+def contains(path, branch, rev):
+    return git(path, "branch", "--contains", rev, "--format=%(refname:short)", branch)
+
+
+def test_parallel_in_memory(repo):
+    git(repo, "checkout", "-q", "master")
+    new = commit(repo, "b")
+    git(repo, "checkout", "-q", "app")
+
+    res = regit(repo, "update", "-j", "2", "--all")
+    assert res.returncode == 0, res.stdout + res.stderr
+    assert "in worktrees" not in res.stdout
+    assert "updated 3 of 3 managed branches, 0 failed, 0 skipped" in res.stdout
+    # clean merges never need a worktree, the checkout follows its branch
+    assert worktrees(repo) == 1
+    for name in ("core_fix", "driver", "app"):
+        assert contains(repo, name, new) == name
+    assert git(repo, "status", "--porcelain") == ""
+    assert (repo / "b").exists()
+
+
+def test_parallel_conflict_in_worktree(repo):
+    git(repo, "checkout", "-q", "master")
+    commit(repo, "core_fix", "conflicting\n")
+    git(repo, "checkout", "-q", "app")
+    app = git(repo, "rev-parse", "app")
+
+    res = regit(repo, "update", "-j", "2", "--all")
+    assert res.returncode == 1
+    assert "updating core_fix in worktrees" in res.stdout
+    assert 'updating "core_fix" failed. resolve in' in res.stdout
+    assert 'skipping branch "driver", "core_fix" failed to update.' in res.stdout
+    assert 'skipping branch "app", "core_fix" failed to update.' in res.stdout
+    assert "0 of 3 managed branches, 1 failed, 2 skipped" in res.stdout
+    assert worktrees(repo) == 2
+    assert git(repo, "rev-parse", "app") == app
+    assert git(repo, "status", "--porcelain") == ""
+
+
+def test_parallel_failure_is_per_branch(repo):
+    git(repo, "checkout", "-q", "master")
+    commit(repo, "b")
+    git(repo, "checkout", "-q", "app")
+    app = git(repo, "rev-parse", "app")
+    # untracked, so the workdir counts as clean, but "reset --keep" refuses
+    (repo / "b").write_text("untracked\n")
+
+    res = regit(repo, "update", "-j", "2", "--all")
+    assert res.returncode == 1
+    assert 'updating "app" failed: ' in res.stdout
+    assert "2 of 3 managed branches, 1 failed, 0 skipped" in res.stdout
+    assert git(repo, "rev-parse", "app") == app
+    assert (repo / "b").read_text() == "untracked\n"
+
+
+def test_parallel_conflict_in_current_branch(repo):
+    git(repo, "checkout", "-q", "master")
+    commit(repo, "core_fix", "conflicting\n")
+    git(repo, "checkout", "-q", "core_fix")
+
+    res = regit(repo, "update", "-j", "2", "--all")
+    # the failure is reported per branch, the loop goes on to the summary
+    assert res.returncode == 1
+    assert "in worktrees" not in res.stdout
+    assert 'updating "core_fix" failed, see above.' in res.stdout
+    assert 'skipping branch "driver", "core_fix" failed to update.' in res.stdout
+    assert "0 of 3 managed branches, 1 failed, 2 skipped" in res.stdout
+    assert worktrees(repo) == 1
+    # stopped here for conflict resolution
+    assert git(repo, "diff", "--name-only", "--diff-filter=U") == "core_fix"
+
+
+def test_recursive_skips_branches_checked_out_elsewhere(repo, tmp_path):
+    git(repo, "checkout", "-q", "master")
+    new = commit(repo, "b")
+    git(repo, "checkout", "-q", "app")
+    worktree = tmp_path / "wt"
+    git(repo, "worktree", "add", "-q", str(worktree), "core_fix")
+    core_fix = git(repo, "rev-parse", "core_fix")
+
+    res = regit(repo, "update", "-r")
+    assert res.returncode == 0, res.stdout + res.stderr
+    assert 'skipping branch "core_fix", it is checked out in %s.' % worktree in res.stdout
+    assert git(repo, "rev-parse", "core_fix") == core_fix
+    assert git(worktree, "status", "--porcelain") == ""
+    assert contains(repo, "app", new) == "app"
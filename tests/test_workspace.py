@@ -0,0 +1,74 @@
+import json
+import shutil
+
+from regit import workspace
+
+from conftest import git, regit
+
+
+def make_workspace(repo, tmp_path):
+    ws = tmp_path / "ws"
+    (ws / "vendor").mkdir(parents=True)
+    for name in ("fw", "vendor/a", "vendor/b"):
+        shutil.copytree(str(repo), str(ws / name))
+    (ws / "vendor" / "plain").mkdir()
+    (ws / "fw" / "sub").mkdir()
+    return ws
+
+
+def test_find_repositories(repo, tmp_path, capsys):
+    ws = make_workspace(repo, tmp_path)
+    patterns = ["vendor/*", "fw/*", "fw", "fw"]
+    found = workspace.find_repositories([str(ws / p) for p in patterns])
+    # in order, once each, only repository top directories from globs
+    assert found == [str(ws / p) for p in ("vendor/a", "vendor/b", "fw")]
+    err = capsys.readouterr().err
+    assert "skipping %s, not a repository" % (ws / "vendor" / "plain") in err
+    assert "skipping %s, not a repository" % (ws / "fw" / "sub") in err
+
+
+def test_read_manifest(tmp_path):
+    manifest = tmp_path / "manifest"
+    manifest.write_text("# comment\n\nfw\n  vendor/*  \n")
+    assert workspace.read_manifest(str(manifest)) == [
+        str(tmp_path / "fw"),
+        str(tmp_path / "vendor/*"),
+    ]
+
+
+def test_run_all(repo, tmp_path):
+    ws = make_workspace(repo, tmp_path)
+    (ws / "vendor" / "b" / "a").write_text("dirty\n")
+    (ws / "manifest").write_text("fw\nvendor/*\n")
+
+    res = regit(
+        ws, "workspace", "update", "missing", "fw/sub",
+        "-m", "manifest", "-j", "2", "--json",
+    )
+    assert res.returncode == 1
+    records = {r["repository"]: r for r in json.loads(res.stdout)}
+    names = ("missing", "fw/sub", "fw", "vendor/a", "vendor/b")
+    assert list(records) == [str(ws / name) for name in names]
+    assert "no such directory" in records[str(ws / "missing")]["output"]
+    assert "not a repository" in records[str(ws / "fw/sub")]["output"]
+    assert records[str(ws / "fw")]["success"]
+    assert records[str(ws / "vendor/a")]["success"]
+    # a failure in one repository does not stop the others
+    assert not records[str(ws / "vendor/b")]["success"]
+    assert "workdir unclean" in records[str(ws / "vendor/b")]["output"]
+
+    for name in ("fw", "vendor/a"):
+        assert "needs update" not in regit(ws / name, "status", "--all").stdout
+    assert "needs update" in regit(ws / "vendor/b", "status", "--all").stdout
+    # nothing ran in the enclosing directory
+    assert git(repo, "status", "--porcelain") == ""
+
+
+def test_report(repo, tmp_path):
+    ws = make_workspace(repo, tmp_path)
+    res = regit(ws, "workspace", "status", "fw", "vendor/*")
+    assert res.returncode == 0
+    lines = [x for x in res.stdout.splitlines() if x.startswith("regit: ")]
+    assert len(lines) == 4
+    assert lines[0].startswith("regit: fw: ok (")
+    assert lines[-1].startswith("regit: 3 of 3 repositories ok, 0 failed")